@@ -84,6 +84,8 @@ class AlertEngine:
 
             if state.alert_states is None:
                 state.alert_states = {}
+            # Modules mutate alert_states in place; it is written back only if they changed it
+            alert_states_before = dict(state.alert_states)
 
             alerts = []
             alert_rows = device.config.get("alert_rows", [])
@@ -118,7 +120,7 @@ class AlertEngine:
                 results = await alert_cls().check_many(position, device, state, params)
                 alerts.extend(results)
 
-            if state.alert_states is not None:
+            if state.alert_states != alert_states_before:
                 db = get_db()
                 await db.update_device_alert_state(device.id, state.alert_states)
 
@@ -159,6 +161,19 @@ class AlertEngine:
             # 3. External notifications (Email, Telegram, SIP call, etc. per user)
             await self._send_notification(user, device, alert_data)
 
+        # 4. Push notification (browser/PWA) to every user in one fan-out
+        try:
+            await get_push_service().notify_users(
+                db_service=get_db(),
+                user_ids=[user.id for user in users],
+                alert_type=alert_data['type'].value,
+                message=alert_data['message'],
+                severity=alert_data.get('severity', 'info'),
+                device_name=device.name,
+            )
+        except Exception as e:
+            logger.error(f"Push notify error: {e}")
+
     async def _send_notification(self, user: User, device: Device, alert_data: Dict[str, Any]):
         try:
             metadata = alert_data.get('alert_metadata', {})
@@ -186,16 +201,7 @@ class AlertEngine:
                 active_channels = [c for c in user_ch if c.get('url')]
 
             if not active_channels:
-                # Still send push notification even with no channels
-                push = get_push_service()
-                await push.notify_user(
-                    db_service=get_db(),
-                    user_id=user.id,
-                    alert_type=alert_data['type'].value,
-                    message=alert_data['message'],
-                    severity=alert_data.get('severity', 'info'),
-                    device_name=device.name,
-                )
+                # Push notification is still sent by _dispatch_alert
                 return
 
             # 3. Dispatch each URL to the matching channel handler
@@ -210,17 +216,6 @@ class AlertEngine:
                 return_exceptions=True
             )
 
-            # 4. Push notification (browser/PWA)
-            push = get_push_service()
-            await push.notify_user(
-                db_service=get_db(),
-                user_id=user.id,
-                alert_type=alert_data['type'].value,
-                message=alert_data['message'],
-                severity=alert_data.get('severity', 'info'),
-                device_name=device.name,
-            )
-
         except Exception as e: 
             logger.error(f"Notify error: {e}")
     
@@ -240,6 +235,11 @@ async def periodic_alert_task():
         try:
             await asyncio.sleep(60)
             db = get_db()
+
+            # Flip devices that stopped reporting past their offline timeout
+            for device, _state in await db.get_offline_devices():
+                await db.mark_device_offline(device.id)
+
             devices = await db.get_all_active_devices_with_state()
             for device, state in devices:
                 for alert_key, alert_cls in ALERT_REGISTRY.items():
@@ -258,14 +258,16 @@ async def periodic_alert_task():
 
                         if state.alert_states is None:
                             state.alert_states = {}
+                        alert_states_before = dict(state.alert_states)
 
                         result = await alert_cls().check_device(device, state, params)
 
-                        # Always persist alert_states — check_device() may have mutated
-                        # it (e.g. setting offline_alerted=True or resetting it to False)
-                        # even when no alert is returned. Without this the flag is lost
-                        # on the next tick and the alert fires again every minute.
-                        await db.update_device_alert_state(device.id, state.alert_states)
+                        # Persist alert_states whenever check_device() mutated it (e.g.
+                        # setting offline_alerted=True or resetting it to False), even
+                        # when no alert is returned. Without this the flag is lost on
+                        # the next tick and the alert fires again every minute.
+                        if state.alert_states != alert_states_before:
+                            await db.update_device_alert_state(device.id, state.alert_states)
 
                         if result:
                             result.setdefault('latitude',  state.last_latitude)
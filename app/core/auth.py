@@ -2,9 +2,14 @@
 Authentication & Authorization
 JWT token validation and role-based access Depends() factories.
 """
+import base64
+import hashlib
+import hmac
+
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 import jwt
+import orjson
 
 from core.config import get_settings
 from core.database import get_db
@@ -13,6 +18,26 @@ from models import User
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/login")
 
 
+def _b64url(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+_HS256_HEADER = _b64url(b'{"alg":"HS256","typ":"JWT"}')
+
+
+def create_access_token(data: dict) -> str:
+    """
+    Sign a JWT for the configured algorithm. HS256, the default, is signed
+    here directly (orjson payload + hashlib HMAC); PyJWT handles the rest.
+    """
+    settings = get_settings()
+    if settings.algorithm != "HS256":
+        return jwt.encode(data, settings.secret_key, algorithm=settings.algorithm)
+    signing_input = _HS256_HEADER + b"." + _b64url(orjson.dumps(data))
+    signature = hmac.new(settings.secret_key.encode("utf-8"), signing_input, hashlib.sha256).digest()
+    return (signing_input + b"." + _b64url(signature)).decode("ascii")
+
+
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     """Validate JWT and return the current User object."""
     credentials_exception = HTTPException(
@@ -74,8 +99,7 @@ async def verify_device_access(
         return current_user
 
     db = get_db()
-    user_devices = await db.get_user_devices(current_user.id)
-    if not any(d.id == device_id for d in user_devices):
+    if not await db.user_has_device(current_user.id, device_id):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You do not have access to this device",
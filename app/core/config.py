@@ -17,10 +17,12 @@ class Settings(BaseSettings):
     # Redis
     redis_url: str = "redis://localhost:6379"
     redis_cache_ttl: int = 3600  # seconds
+    redis_pubsub_enabled: bool = True  # off: broadcasts stay in-process (single API worker only)
     
     # Network Servers - Protocol Specific Ports
     tcp_host: str = "0.0.0.0"
     udp_host: str = "0.0.0.0"
+    max_device_connections: int = 20000  # oldest TCP session is closed beyond this
     
     # API Server
     api_host: str = "0.0.0.0"
@@ -31,6 +33,7 @@ class Settings(BaseSettings):
     secret_key: str = "your-secret-key-change-in-production"
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
+    bcrypt_rounds: int = 12  # lower in dev for faster logins, raise in prod
     
     # Logging
     log_level: str = "INFO"
@@ -63,7 +66,7 @@ class Settings(BaseSettings):
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
-        extra = "ignore"  # Allow unknown .env keys (e.g. vapid_*, custom app keys)
+        extra = "ignore"  # Allow unknown .env keys (e.g. custom app keys)
 
 
 # Global settings instance
@@ -1,6 +1,7 @@
 # ... existing imports ...
 import asyncio
-from typing import Optional, List, Dict, Any
+import time
+from typing import Optional, List, Dict, Any, AsyncIterator
 from datetime import datetime, timedelta, timezone
 from contextlib import asynccontextmanager
 
@@ -10,21 +11,177 @@ from sqlalchemy.ext.asyncio import (
     async_sessionmaker,
     AsyncEngine
 )
-from sqlalchemy import select, update, delete, and_, or_, func, text
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, update, delete, and_, or_, func, text, bindparam, lambda_stmt, Boolean, Integer, Float
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from geoalchemy2 import Geography
+from geoalchemy2.shape import from_shape
+from shapely.geometry import LineString, Polygon
 from geoalchemy2.functions import ST_Distance, ST_MakePoint, ST_Contains, ST_SetSRID
+import asyncpg
 import bcrypt
+import orjson
 
 from models import (
     Base, User, Device, DeviceState, PositionRecord, 
-    Trip, Geofence, AlertHistory, CommandQueue
+    Trip, Geofence, AlertHistory, CommandQueue, user_device_association
 )
+from core.config import get_settings
 from models.schemas import NormalizedPosition, AlertCreate, CommandCreate, DeviceCreate, GeofenceCreate, UserCreate, UserUpdate
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Device rows (id, config) change rarely, so the ingest path keeps them in memory
+IMEI_CACHE_TTL = 60.0
+IMEI_CACHE_MAX_SIZE = 10000
+
+# Read-through caches for dashboard polling; writers invalidate their entries
+DEVICE_STATE_CACHE_TTL = 2.0
+GEOFENCE_CACHE_TTL = 60.0
+USER_DEVICE_IDS_CACHE_TTL = 60.0
+
+# Rows fetched per round-trip when streaming position history
+POSITION_HISTORY_BATCH = 1000
+
+# Live position records are buffered and written with COPY: every
+# POSITION_FLUSH_INTERVAL seconds, or sooner once POSITION_FLUSH_SIZE are waiting.
+POSITION_FLUSH_INTERVAL = 0.2
+POSITION_FLUSH_SIZE = 500
+# Records kept for retry while the database is unreachable before the oldest are dropped
+POSITION_BUFFER_MAX = 50000
+_POSITION_COPY_COLUMNS = (
+    'device_id', 'device_time', 'latitude', 'longitude', 'altitude',
+    'speed', 'course', 'satellites', 'ignition', 'sensors',
+)
+# Row-at-a-time fallback when a COPY batch holds rows the database rejects
+_POSITION_INSERT_SQL = 'INSERT INTO position_records ({}) VALUES ({})'.format(
+    ', '.join(_POSITION_COPY_COLUMNS),
+    ', '.join(f'${i}' for i in range(1, len(_POSITION_COPY_COLUMNS) + 1)),
+)
+# Errors caused by the rows themselves (e.g. a device deleted while its fixes
+# were buffered); retrying the same batch can never succeed
+_REJECTED_ROW_ERRORS = (asyncpg.IntegrityConstraintViolationError, asyncpg.DataError)
+
+# Per-ping state write, built once. Trip open/close stays on the ORM path;
+# everything else a position touches is a single parametrized UPDATE.
+_UPDATE_STATE_STMT = (
+    update(DeviceState)
+    .where(DeviceState.device_id == bindparam('p_device_id'))
+    .values(
+        total_odometer=DeviceState.total_odometer + bindparam('p_distance_km'),
+        trip_odometer=DeviceState.trip_odometer + bindparam('p_trip_distance_km'),
+        last_latitude=bindparam('p_latitude'),
+        last_longitude=bindparam('p_longitude'),
+        last_altitude=bindparam('p_altitude'),
+        last_speed=bindparam('p_speed'),
+        last_course=bindparam('p_course'),
+        last_update=func.timezone('utc', func.now()),
+        ignition_on=func.coalesce(bindparam('p_ignition', type_=Boolean), DeviceState.ignition_on),
+        is_moving=bindparam('p_is_moving'),
+        is_online=True,
+    )
+    .execution_options(synchronize_session=False)
+)
+
+# Hot lookups compiled once; parameters are bound at execute time
+_DEVICE_BY_IMEI_STMT = lambda_stmt(
+    lambda: select(Device.id, Device.config, Device.protocol, Device.name).where(Device.imei == bindparam('imei'))
+)
+_HAS_DEVICE_ACCESS_STMT = lambda_stmt(
+    lambda: select(
+        select(user_device_association.c.device_id)
+        .where(and_(
+            user_device_association.c.user_id == bindparam('user_id'),
+            user_device_association.c.device_id == bindparam('device_id'),
+        ))
+        .exists()
+    )
+)
+_PENDING_COMMANDS_STMT = lambda_stmt(
+    lambda: select(CommandQueue)
+    .where(and_(CommandQueue.device_id == bindparam('device_id'), CommandQueue.status == 'pending'))
+    .order_by(CommandQueue.created_at)
+)
+# In-place upgrades for databases created by older versions. create_all only
+# adds missing tables, so column/constraint changes go here; each must be idempotent.
+_SCHEMA_UPGRADES = [
+    # push_subscriptions: user_id replaces the surrogate id as primary key
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM information_schema.columns
+                   WHERE table_name = 'push_subscriptions' AND column_name = 'id') THEN
+            ALTER TABLE push_subscriptions DROP COLUMN id;
+            ALTER TABLE push_subscriptions DROP CONSTRAINT IF EXISTS push_subscriptions_user_id_key;
+            ALTER TABLE push_subscriptions ADD PRIMARY KEY (user_id);
+        END IF;
+    END $$;
+    """,
+    "ALTER TABLE IF EXISTS push_subscriptions ALTER COLUMN updated_at SET DEFAULT timezone('utc', now())",
+    # Insert timestamps for alerts, commands and device grants come from the database
+    "ALTER TABLE IF EXISTS alert_history ALTER COLUMN created_at SET DEFAULT timezone('utc', now())",
+    "ALTER TABLE IF EXISTS command_queue ALTER COLUMN created_at SET DEFAULT timezone('utc', now())",
+    "ALTER TABLE IF EXISTS user_device_access ALTER COLUMN created_at SET DEFAULT timezone('utc', now())",
+    # JSONB column defaults live in the database
+    "ALTER TABLE IF EXISTS users ALTER COLUMN notification_channels SET DEFAULT "
+    """'{"telegram": null, "email": null, "slack": null, "discord": null}'::jsonb""",
+    "ALTER TABLE IF EXISTS devices ALTER COLUMN config SET DEFAULT '{}'::jsonb",
+    "ALTER TABLE IF EXISTS device_states ALTER COLUMN alert_states SET DEFAULT '{}'::jsonb",
+    "ALTER TABLE IF EXISTS device_states ALTER COLUMN sensors SET DEFAULT '{}'::jsonb",
+    "ALTER TABLE IF EXISTS position_records ALTER COLUMN sensors SET DEFAULT '{}'::jsonb",
+    "ALTER TABLE IF EXISTS alert_history ALTER COLUMN alert_metadata SET DEFAULT '{}'::jsonb",
+    # position_records: the (device_id, device_time) index serves every query
+    "DROP INDEX IF EXISTS ix_position_records_device_id",
+    "DROP INDEX IF EXISTS ix_position_records_device_time",
+]
+
+# Columns the history endpoint reads; rows skip ORM identity-map hydration
+_POSITION_HISTORY_COLUMNS = (
+    PositionRecord.device_time,
+    PositionRecord.latitude,
+    PositionRecord.longitude,
+    PositionRecord.altitude,
+    PositionRecord.speed,
+    PositionRecord.course,
+    PositionRecord.satellites,
+    PositionRecord.ignition,
+    PositionRecord.sensors,
+)
+
+_CREATE_STATE_STMT = (
+    pg_insert(DeviceState)
+    .values(device_id=bindparam('p_device_id'))
+    .on_conflict_do_nothing(index_elements=['device_id'])
+    .returning(DeviceState)
+)
+
+
+async def _hash_password(password: str) -> str:
+    """bcrypt is deliberately slow; run it in a worker thread so the event loop keeps serving."""
+    salt = bcrypt.gensalt(rounds=get_settings().bcrypt_rounds)
+    hashed = await asyncio.to_thread(bcrypt.hashpw, password.encode('utf-8'), salt)
+    return hashed.decode('utf-8')
+
+
+def _geofence_geometry(coords: List[List[float]], geometry_type: str):
+    """Build the geofence shape in Python and bind it as WKB, skipping WKT formatting and parsing."""
+    shape = LineString(coords) if geometry_type == 'polyline' else Polygon(coords)
+    return from_shape(shape, srid=4326)
+
+
+_dummy_password_hash: Optional[bytes] = None
+
+
+async def _get_dummy_password_hash() -> bytes:
+    """Hash checked against on unknown logins so a miss costs the same as a wrong password."""
+    global _dummy_password_hash
+    if _dummy_password_hash is None:
+        _dummy_password_hash = (await _hash_password('dummy-password')).encode('utf-8')
+    return _dummy_password_hash
+
 
 class DatabaseService:
     # ... existing __init__ and init_db methods ...
@@ -42,13 +199,41 @@ class DatabaseService:
             class_=AsyncSession,
             expire_on_commit=False
         )
+
+        # imei -> ((id, config, protocol, name) row, expires_at)
+        self._imei_cache: Dict[str, tuple[Row, float]] = {}
+        # device ids whose device_states row is known to exist
+        self._known_states: set[int] = set()
+        # device_id -> (state, expires_at)
+        self._state_cache: Dict[int, tuple[DeviceState, float]] = {}
+        # device_id filter (None = all) -> (geofences, expires_at)
+        self._geofence_cache: Dict[Optional[int], tuple[List[dict], float]] = {}
+        # bumped on every geofence write; a read that straddles one is not cached
+        self._geofence_generation = 0
+        # user_id -> (assigned device ids, expires_at)
+        self._user_device_ids_cache: Dict[int, tuple[List[int], float]] = {}
+        # position_records rows waiting for the next COPY, in _POSITION_COPY_COLUMNS order
+        self._pending_positions: List[tuple] = []
+        self._position_flush_wanted = asyncio.Event()
+        self._position_flush_task: Optional[asyncio.Task] = None
     
     async def init_db(self):
         """Initialize database schema"""
         async with self.engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
             await conn.execute(text("CREATE EXTENSION IF NOT EXISTS postgis;"))
+            for statement in _SCHEMA_UPGRADES:
+                await conn.execute(text(statement))
+            # create_all skips tables that already exist, so bring their indexes up to date too
+            await conn.run_sync(self._create_missing_indexes)
             logger.info("Database initialized")
+        self._position_flush_task = asyncio.create_task(self._run_position_flusher())
+
+    @staticmethod
+    def _create_missing_indexes(sync_conn):
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(sync_conn, checkfirst=True)
     
     @asynccontextmanager
     async def get_session(self) -> AsyncSession:
@@ -60,45 +245,145 @@ class DatabaseService:
                 await session.rollback()
                 logger.error(f"Database error: {e}", exc_info=True)
                 raise
+
+    @asynccontextmanager
+    async def get_readonly_session(self) -> AsyncSession:
+        """Session for pure reads: runs in a READ ONLY transaction and is never committed."""
+        async with self.async_session_maker() as session:
+            try:
+                await session.connection(execution_options={"postgresql_readonly": True})
+                yield session
+            except Exception as e:
+                logger.error(f"Database error: {e}", exc_info=True)
+                raise
     
     async def close(self):
+        if self._position_flush_task:
+            self._position_flush_task.cancel()
+            try:
+                await self._position_flush_task
+            except asyncio.CancelledError:
+                pass
+            await self._flush_positions()
         await self.engine.dispose()
 
+    async def _run_position_flusher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._position_flush_wanted.wait(), POSITION_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._position_flush_wanted.clear()
+            await self._flush_positions()
+
+    async def _flush_positions(self):
+        """
+        COPY every buffered position record in one go. Rows the database rejects are
+        dropped one by one; on any other failure the batch is kept for the next try.
+        """
+        records = self._pending_positions
+        if not records:
+            return
+        self._pending_positions = []
+        try:
+            async with self.engine.connect() as conn:
+                raw = (await conn.get_raw_connection()).driver_connection
+                try:
+                    await raw.copy_records_to_table(
+                        'position_records', records=records, columns=_POSITION_COPY_COLUMNS,
+                    )
+                except _REJECTED_ROW_ERRORS as e:
+                    logger.warning(f"Position batch rejected ({e}); inserting {len(records)} records one by one")
+                    records = await self._insert_positions_individually(raw, records)
+        except asyncio.CancelledError:
+            self._pending_positions[:0] = records
+            raise
+        except Exception as e:
+            logger.error(f"Position flush failed ({len(records)} records): {e}")
+            self._pending_positions[:0] = records
+            overflow = len(self._pending_positions) - POSITION_BUFFER_MAX
+            if overflow > 0:
+                logger.warning(f"Position buffer full, dropping {overflow} oldest records")
+                del self._pending_positions[:overflow]
+
+    @staticmethod
+    async def _insert_positions_individually(raw, records: List[tuple]) -> List[tuple]:
+        """Insert records one at a time, discarding rejected rows. Returns [] when done."""
+        dropped = 0
+        for i, record in enumerate(records):
+            try:
+                await raw.execute(_POSITION_INSERT_SQL, *record)
+            except _REJECTED_ROW_ERRORS as e:
+                dropped += 1
+                logger.warning(f"Dropping position record for device {record[0]}: {e}")
+            except BaseException:
+                # Connection trouble: hand the rows not yet written back to the caller's requeue
+                del records[:i]
+                raise
+        if dropped:
+            logger.warning(f"Dropped {dropped} of {len(records)} position records rejected by the database")
+        return []
+
     # ... existing Device Operations ...
     async def get_device_by_imei(self, imei: str) -> Optional[Device]:
-        async with self.get_session() as session:
+        async with self.get_readonly_session() as session:
             result = await session.execute(
                 select(Device)
                 .where(Device.imei == imei)
                 .options(
-                    selectinload(Device.state),
+                    # state is one-to-one, so it rides along in the device query
+                    joinedload(Device.state),
                     selectinload(Device.users)
                 )
             )
             return result.scalar_one_or_none()
     
     async def get_device_by_id(self, device_id: int) -> Optional[Device]:
-        async with self.get_session() as session:
+        async with self.get_readonly_session() as session:
             result = await session.execute(
                 select(Device)
                 .where(Device.id == device_id)
                 .options(
-                    selectinload(Device.state),
+                    # state is one-to-one, so it rides along in the device query
+                    joinedload(Device.state),
                     selectinload(Device.users)
                 )
             )
             return result.scalar_one_or_none()
     
     async def get_user_devices(self, user_id: int) -> List[Device]:
-        async with self.get_session() as session:
+        async with self.get_readonly_session() as session:
             result = await session.execute(
                 select(Device)
                 .join(Device.users)
                 .where(User.id == user_id)
-                .options(selectinload(Device.state))
             )
             return result.scalars().all()
 
+    async def user_has_device(self, user_id: int, device_id: int) -> bool:
+        """Access check straight on the association primary key; never cached, so revocations apply at once."""
+        async with self.get_readonly_session() as session:
+            return await session.scalar(_HAS_DEVICE_ACCESS_STMT, {'user_id': user_id, 'device_id': device_id})
+
+    async def get_user_device_ids(self, user_id: int) -> List[int]:
+        """Ids of the devices assigned to a user, straight from the association table."""
+        now = time.monotonic()
+        cached = self._user_device_ids_cache.get(user_id)
+        if cached and cached[1] > now:
+            return cached[0]
+
+        async with self.get_readonly_session() as session:
+            result = await session.scalars(
+                select(user_device_association.c.device_id)
+                .where(user_device_association.c.user_id == user_id)
+            )
+            device_ids = list(result)
+        self._user_device_ids_cache[user_id] = (device_ids, now + USER_DEVICE_IDS_CACHE_TTL)
+        return device_ids
+
+    def invalidate_user_devices(self, user_id: int):
+        self._user_device_ids_cache.pop(user_id, None)
+
     # ... existing Position Processing ...
     async def process_position(self, position: NormalizedPosition) -> bool:
         # Ensure device_time is naive UTC
@@ -107,12 +392,13 @@ class DatabaseService:
             device_time = device_time.astimezone(timezone.utc).replace(tzinfo=None)
         
         async with self.get_session() as session:
-            device = await self._get_device_by_imei_internal(session, position.imei)
-            if not device:
+            cached = await self._get_device_by_imei_internal(session, position.imei)
+            if not cached:
                 logger.warning(f"Unknown device: {position.imei}")
                 return False
+            device_id, _config = cached
             
-            state = await self._get_or_create_state(session, device.id)
+            state = await self._get_or_create_state(session, device_id)
             
             distance_km = 0.0
             if state.last_latitude:
@@ -125,52 +411,91 @@ class DatabaseService:
                 if distance_km > 50.0:
                     distance_km = 0.0
 
-            await self._handle_trip_logic(session, device, state, position, device_time)
-            
-            state.total_odometer += distance_km
-            if state.active_trip_id:
-                state.trip_odometer += distance_km
-            
-            state.last_latitude = position.latitude
-            state.last_longitude = position.longitude
-            state.last_altitude = position.altitude
-            state.last_speed = position.speed
-            state.last_course = position.course
-            state.last_update = datetime.utcnow()
-            if position.ignition is not None:
-                state.ignition_on = position.ignition
-            state.is_moving = (position.speed or 0) > 1.0
-            state.is_online = True
-            
-            position_record = PositionRecord(
-                device_id=device.id,
-                latitude=position.latitude,
-                longitude=position.longitude,
-                altitude=position.altitude,
-                speed=position.speed,
-                course=position.course,
-                satellites=position.satellites,
-                ignition=position.ignition,
-                sensors=position.sensors,
-                device_time=device_time,
-            )
+            await self._handle_trip_logic(session, device_id, state, position, device_time)
 
+            await session.execute(_UPDATE_STATE_STMT, {
+                'p_device_id': device_id,
+                'p_distance_km': distance_km,
+                'p_trip_distance_km': distance_km if state.active_trip_id else 0.0,
+                'p_latitude': position.latitude,
+                'p_longitude': position.longitude,
+                'p_altitude': position.altitude,
+                'p_speed': position.speed,
+                'p_course': position.course,
+                'p_ignition': position.ignition,
+                'p_is_moving': (position.speed or 0) > 1.0,
+            })
+        # Only once committed, or a concurrent get_device_state would re-cache the old row
+        self._state_cache.pop(device_id, None)
+
+        # The history row follows in the next COPY batch
+        self._pending_positions.append((
+            device_id, device_time, position.latitude, position.longitude, position.altitude,
+            position.speed, position.course, position.satellites, position.ignition,
+            orjson.dumps(position.sensors or {}).decode(),
+        ))
+        if len(self._pending_positions) >= POSITION_FLUSH_SIZE:
+            self._position_flush_wanted.set()
+        return True
             
-            session.add(position_record)
-            await session.flush()
-            return True
-            
-    async def _get_device_by_imei_internal(self, session: AsyncSession, imei: str) -> Optional[Device]:
-        result = await session.execute(select(Device).where(Device.imei == imei))
-        return result.scalar_one_or_none()
+    async def _get_device_by_imei_internal(self, session: AsyncSession, imei: str) -> Optional[tuple[int, dict]]:
+        """Resolve an IMEI to (device_id, config), served from the in-process cache when fresh."""
+        row = self._cached_imei_row(imei) or await self._load_imei_row(session, imei)
+        if row is None:
+            return None
+        return row.id, row.config or {}
+
+    async def get_device_ref_by_imei(self, imei: str) -> Optional[Row]:
+        """
+        id, config, protocol and name of the device with this IMEI, from the
+        IMEI cache when fresh. For hot paths that don't need state or users.
+        """
+        row = self._cached_imei_row(imei)
+        if row is None:
+            async with self.get_readonly_session() as session:
+                row = await self._load_imei_row(session, imei)
+        return row
+
+    def _cached_imei_row(self, imei: str) -> Optional[Row]:
+        cached = self._imei_cache.get(imei)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        return None
+
+    async def _load_imei_row(self, session: AsyncSession, imei: str) -> Optional[Row]:
+        result = await session.execute(_DEVICE_BY_IMEI_STMT, {'imei': imei})
+        row = result.one_or_none()
+        if row is None:
+            self._imei_cache.pop(imei, None)
+            return None
+
+        if imei not in self._imei_cache and len(self._imei_cache) >= IMEI_CACHE_MAX_SIZE:
+            # Evict the oldest entry (dicts keep insertion order)
+            self._imei_cache.pop(next(iter(self._imei_cache)))
+        self._imei_cache[imei] = (row, time.monotonic() + IMEI_CACHE_TTL)
+        return row
+
+    def _invalidate_device_cache(self, imei: Optional[str] = None, device_id: Optional[int] = None):
+        if imei is not None:
+            self._imei_cache.pop(imei, None)
+        if device_id is not None:
+            for key in [k for k, v in self._imei_cache.items() if v[0].id == device_id]:
+                del self._imei_cache[key]
+            self._known_states.discard(device_id)
+            self._state_cache.pop(device_id, None)
     
     async def _get_or_create_state(self, session: AsyncSession, device_id: int) -> DeviceState:
-        result = await session.execute(select(DeviceState).where(DeviceState.device_id == device_id))
-        state = result.scalar_one_or_none()
-        if not state:
-            state = DeviceState(device_id=device_id)
-            session.add(state)
-            await session.flush()
+        if device_id in self._known_states:
+            state = await session.get(DeviceState, device_id)
+            if state:
+                return state
+
+        # First ping for this device in this process: create-or-fetch in one statement
+        result = await session.scalars(_CREATE_STATE_STMT, {'p_device_id': device_id})
+        state = result.one_or_none()
+        if state is None:
+            state = await session.get(DeviceState, device_id)
+        self._known_states.add(device_id)
         return state
     
     async def _calculate_distance(self, session: AsyncSession, lat1: float, lon1: float, lat2: float, lon2: float) -> float:
@@ -184,12 +509,31 @@ class DatabaseService:
         distance_meters = result.scalar() or 0.0
         return distance_meters / 1000.0
     
-    async def _handle_trip_logic(self, session: AsyncSession, device: Device, state: DeviceState, position: NormalizedPosition, device_time: datetime):
+    async def _calculate_distances(self, session: AsyncSession, hops: List[tuple[float, float, float, float]]) -> List[float]:
+        """Distances in km for (lat1, lon1, lat2, lon2) hops, in input order, in one round-trip."""
+        if not hops:
+            return []
+        lat1, lon1, lat2, lon2 = (list(col) for col in zip(*hops))
+        u = func.unnest(
+            bindparam('lat1', lat1, type_=ARRAY(Float)), bindparam('lon1', lon1, type_=ARRAY(Float)),
+            bindparam('lat2', lat2, type_=ARRAY(Float)), bindparam('lon2', lon2, type_=ARRAY(Float)),
+        ).table_valued('lat1', 'lon1', 'lat2', 'lon2', with_ordinality='ord')
+        result = await session.execute(
+            select(func.ST_Distance(
+                func.ST_MakePoint(u.c.lon1, u.c.lat1).cast(Geography),
+                func.ST_MakePoint(u.c.lon2, u.c.lat2).cast(Geography)
+            ))
+            .select_from(u)
+            .order_by(u.c.ord)
+        )
+        return [(meters or 0.0) / 1000.0 for meters in result.scalars()]
+    
+    async def _handle_trip_logic(self, session: AsyncSession, device_id: int, state: DeviceState, position: NormalizedPosition, device_time: datetime):
         if position.ignition is None: return
         
         if position.ignition and not state.active_trip_id:
             trip = Trip(
-                device_id=device.id,
+                device_id=device_id,
                 start_time=device_time,
                 start_latitude=position.latitude,
                 start_longitude=position.longitude,
@@ -220,62 +564,66 @@ class DatabaseService:
             state.active_trip_id = None
             state.last_ignition_off = device_time
 
-    async def get_position_history(self, device_id: int, start_time: datetime, end_time: datetime, max_points: int = 1000, order: str = 'asc') -> List[PositionRecord]:
+    async def get_position_history(self, device_id: int, start_time: datetime, end_time: datetime, max_points: int = 1000, order: str = 'asc') -> AsyncIterator[Row]:
+        """
+        Stream positions through a server-side cursor so memory stays bounded by the batch size.
+        Yields plain rows with the PositionRecord column names, not ORM objects.
+        """
         if start_time.tzinfo: start_time = start_time.astimezone(timezone.utc).replace(tzinfo=None)
         if end_time.tzinfo: end_time = end_time.astimezone(timezone.utc).replace(tzinfo=None)
         
         sort_order = PositionRecord.device_time.desc() if order == 'desc' else PositionRecord.device_time.asc()
         
-        async with self.get_session() as session:
-            result = await session.execute(
-                select(PositionRecord)
+        async with self.get_readonly_session() as session:
+            result = await session.stream(
+                select(*_POSITION_HISTORY_COLUMNS)
                 .where(and_(PositionRecord.device_id == device_id, PositionRecord.device_time >= start_time, PositionRecord.device_time <= end_time))
                 .order_by(sort_order)
                 .limit(max_points)
+                .execution_options(yield_per=POSITION_HISTORY_BATCH)
             )
-            return result.scalars().all()
+            async for position in result:
+                yield position
 
     async def check_geofence_violations(self, device_id: int, latitude: float, longitude: float) -> List[Dict[str, Any]]:
-        async with self.get_session() as session:
+        # Coordinates are bound as floats and the point is built server-side once;
+        # ST_Contains is evaluated for every candidate geofence in the same query.
+        point = func.ST_SetSRID(
+            func.ST_MakePoint(bindparam('lon', longitude, type_=Float), bindparam('lat', latitude, type_=Float)),
+            4326
+        )
+        async with self.get_readonly_session() as session:
             result = await session.execute(
-                select(Geofence)
+                select(
+                    Geofence.id,
+                    Geofence.name,
+                    Geofence.alert_on_enter,
+                    Geofence.alert_on_exit,
+                    func.ST_Contains(Geofence.polygon, point).label('is_inside'),
+                )
                 .where(and_(
                     or_(Geofence.device_id == device_id, Geofence.device_id.is_(None)),
                     Geofence.is_active == True
                 ))
             )
-            geofences = result.scalars().all()
             violations = []
             
-            for geofence in geofences:
-                point = func.ST_SetSRID(func.ST_MakePoint(longitude, latitude), 4326)
-                
-                contains_query = select(func.ST_Contains(geofence.polygon, point))
-                result = await session.execute(contains_query)
-                is_inside = result.scalar()
-                
-                if is_inside and geofence.alert_on_enter:
+            for geofence in result:
+                if geofence.is_inside and geofence.alert_on_enter:
                     violations.append({"type": "enter", "geofence_id": geofence.id, "geofence_name": geofence.name})
-                elif not is_inside and geofence.alert_on_exit:
+                elif not geofence.is_inside and geofence.alert_on_exit:
                     violations.append({"type": "exit", "geofence_id": geofence.id, "geofence_name": geofence.name})
             return violations
 
     async def create_geofence(self, geofence_data: Dict[str, Any]) -> Geofence:
         async with self.get_session() as session:
-            coords = geofence_data['polygon']
             geometry_type = geofence_data.get('geometry_type', 'polygon')
-            wkt_coords = ', '.join([f"{lon} {lat}" for lon, lat in coords])
-
-            if geometry_type == 'polyline':
-                polygon_wkt = f"LINESTRING({wkt_coords})"
-            else:
-                polygon_wkt = f"POLYGON(({wkt_coords}))"
 
             geofence = Geofence(
                 device_id=geofence_data.get('device_id'),
                 name=geofence_data['name'],
                 description=geofence_data.get('description'),
-                polygon=f'SRID=4326;{polygon_wkt}',
+                polygon=_geofence_geometry(geofence_data['polygon'], geometry_type),
                 alert_on_enter=geofence_data.get('alert_on_enter', False),
                 alert_on_exit=geofence_data.get('alert_on_exit', False),
                 color=geofence_data.get('color', '#3388ff'),
@@ -283,7 +631,9 @@ class DatabaseService:
             )
             session.add(geofence)
             await session.flush()
-            return geofence
+        # Only once committed, or a concurrent read would re-cache the old rows
+        self._invalidate_geofences()
+        return geofence
 
     async def update_geofence(self, geofence_id: int, update_data: dict) -> Optional[Geofence]:
         async with self.get_session() as session:
@@ -305,20 +655,16 @@ class DatabaseService:
             if 'geometry_type' in update_data and update_data['geometry_type'] is not None:
                 geofence.geometry_type = update_data['geometry_type']
             if 'polygon' in update_data and update_data['polygon'] is not None:
-                coords = update_data['polygon']
-                wkt_coords = ', '.join([f"{lon} {lat}" for lon, lat in coords])
                 gtype = update_data.get('geometry_type') or geofence.geometry_type or 'polygon'
-                if gtype == 'polyline':
-                    geofence.polygon = f'SRID=4326;LINESTRING({wkt_coords})'
-                else:
-                    geofence.polygon = f'SRID=4326;POLYGON(({wkt_coords}))'
+                geofence.polygon = _geofence_geometry(update_data['polygon'], gtype)
 
             await session.flush()
-            return geofence
+        self._invalidate_geofences()
+        return geofence
 
     async def create_user(self, user_data: UserCreate) -> User:
+        password_hash = await _hash_password(user_data.password)
         async with self.get_session() as session:
-            password_hash = bcrypt.hashpw(user_data.password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
             user = User(
                 username=user_data.username,
                 email=user_data.email,
@@ -332,31 +678,36 @@ class DatabaseService:
             return user
     
     # New method for authentication
-    async def authenticate_user(self, username: str, password: str) -> Optional[User]:
-        async with self.get_session() as session:
+    async def authenticate_user(self, username: str, password: str) -> Optional[Row]:
+        """Returns (id, username, is_admin) for valid credentials, else None."""
+        async with self.get_readonly_session() as session:
             # Allow login by username or email
             result = await session.execute(
-                select(User).where(or_(User.username == username, User.email == username))
+                select(User.id, User.username, User.is_admin, User.password_hash)
+                .where(or_(User.username == username, User.email == username))
             )
-            user = result.scalar_one_or_none()
-            
-            if not user:
-                return None
-            
-            if bcrypt.checkpw(password.encode('utf-8'), user.password_hash.encode('utf-8')):
-                return user
-            
+            user = result.first()
+        
+        if not user:
+            # Still pay for a bcrypt compare so response time does not reveal unknown usernames
+            await asyncio.to_thread(bcrypt.checkpw, password.encode('utf-8'), await _get_dummy_password_hash())
             return None
+        
+        if await asyncio.to_thread(bcrypt.checkpw, password.encode('utf-8'), user.password_hash.encode('utf-8')):
+            return user
+        
+        return None
 
     async def update_user(self, user_id: int, user_data: UserUpdate) -> Optional[User]:
+        password_hash = await _hash_password(user_data.password) if user_data.password else None
         async with self.get_session() as session:
             result = await session.execute(select(User).where(User.id == user_id))
             user = result.scalar_one_or_none()
             if not user: return None
             
             if user_data.email: user.email = user_data.email
-            if user_data.password:
-                user.password_hash = bcrypt.hashpw(user_data.password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+            if password_hash:
+                user.password_hash = password_hash
             if user_data.notification_channels is not None:
                 user.notification_channels = user_data.notification_channels
             if user_data.language: user.language = user_data.language
@@ -366,7 +717,7 @@ class DatabaseService:
             return user
 
     async def get_user(self, user_id: int) -> Optional[User]:
-        async with self.get_session() as session:
+        async with self.get_readonly_session() as session:
             result = await session.execute(select(User).where(User.id == user_id))
             return result.scalar_one_or_none()
 
@@ -387,7 +738,8 @@ class DatabaseService:
             state = DeviceState(device_id=device.id)
             session.add(state)
             await session.flush()
-            return device
+        self._invalidate_device_cache(imei=device.imei)
+        return device
 
     async def get_device(self, device_id: int) -> Optional[Device]:
         return await self.get_device_by_id(device_id)
@@ -398,6 +750,7 @@ class DatabaseService:
             device = result.scalar_one_or_none()
             if not device: return None
             
+            old_imei = device.imei
             device.name = device_data.name
             device.imei = device_data.imei
             device.protocol = device_data.protocol
@@ -408,22 +761,38 @@ class DatabaseService:
             
             await session.flush()
             await session.refresh(device)
-            return device
+        # After the commit, so a concurrent ingest cannot re-cache the old row;
+        # the old IMEI goes too when it changed
+        self._invalidate_device_cache(imei=old_imei, device_id=device.id)
+        self._imei_cache.pop(device.imei, None)
+        return device
 
     async def delete_device(self, device_id: int) -> bool:
         async with self.get_session() as session:
             result = await session.execute(delete(Device).where(Device.id == device_id))
-            return result.rowcount > 0
+        self._invalidate_device_cache(device_id=device_id)
+        self._user_device_ids_cache.clear()
+        # Buffered fixes would now fail the position_records foreign key
+        self._pending_positions = [r for r in self._pending_positions if r[0] != device_id]
+        return result.rowcount > 0
 
     async def add_device_to_user(self, user_id: int, device_id: int, access_level: str = "admin"):
         async with self.get_session() as session:
-            from models import user_device_association
             await session.execute(user_device_association.insert().values(user_id=user_id, device_id=device_id, access_level=access_level))
+        self.invalidate_user_devices(user_id)
 
     async def get_device_state(self, device_id: int) -> Optional[DeviceState]:
-        async with self.get_session() as session:
+        now = time.monotonic()
+        cached = self._state_cache.get(device_id)
+        if cached and cached[1] > now:
+            return cached[0]
+
+        async with self.get_readonly_session() as session:
             result = await session.execute(select(DeviceState).where(DeviceState.device_id == device_id))
-            return result.scalar_one_or_none()
+            state = result.scalar_one_or_none()
+        if state is not None:
+            self._state_cache[device_id] = (state, now + DEVICE_STATE_CACHE_TTL)
+        return state
 
     async def save_position(self, device_id: int, position: NormalizedPosition) -> DeviceState:
         await self.process_position(position)
@@ -433,17 +802,23 @@ class DatabaseService:
         if start_date.tzinfo: start_date = start_date.astimezone(timezone.utc).replace(tzinfo=None)
         if end_date.tzinfo: end_date = end_date.astimezone(timezone.utc).replace(tzinfo=None)
         
-        async with self.get_session() as session:
+        async with self.get_readonly_session() as session:
             result = await session.execute(select(Trip).where(and_(Trip.device_id == device_id, Trip.start_time >= start_date, Trip.start_time <= end_date)).order_by(Trip.start_time.desc()))
             return result.scalars().all()
             
     async def get_trip(self, trip_id: int) -> Optional[Trip]:
-        async with self.get_session() as session:
+        async with self.get_readonly_session() as session:
             result = await session.execute(select(Trip).where(Trip.id == trip_id))
             return result.scalar_one_or_none()
 
     async def get_geofences(self, device_id: Optional[int] = None) -> List[dict]:
-        async with self.get_session() as session:
+        now = time.monotonic()
+        cached = self._geofence_cache.get(device_id)
+        if cached and cached[1] > now:
+            return cached[0]
+        generation = self._geofence_generation
+
+        async with self.get_readonly_session() as session:
             # Use ST_AsGeoJSON to get coordinates as JSON from PostGIS
             query = select(
                 Geofence.id,
@@ -491,12 +866,21 @@ class DatabaseService:
                     'coordinates': coords,
                 })
 
-            return geofences
+        # A write committed mid-read may not be reflected in these rows
+        if generation == self._geofence_generation:
+            self._geofence_cache[device_id] = (geofences, now + GEOFENCE_CACHE_TTL)
+        return geofences
 
     async def delete_geofence(self, geofence_id: int) -> bool:
         async with self.get_session() as session:
             result = await session.execute(delete(Geofence).where(Geofence.id == geofence_id))
-            return result.rowcount > 0
+        self._invalidate_geofences()
+        return result.rowcount > 0
+
+    def _invalidate_geofences(self):
+        """Call after the write has committed."""
+        self._geofence_generation += 1
+        self._geofence_cache.clear()
 
     async def create_alert(self, alert_data: AlertCreate) -> AlertHistory:
         async with self.get_session() as session:
@@ -522,7 +906,7 @@ class DatabaseService:
             return result.rowcount > 0
 
     async def get_user_alerts(self, user_id: int, unread_only: bool = False, device_id: Optional[int] = None, limit: int = 50) -> List[AlertHistory]:
-        async with self.get_session() as session:
+        async with self.get_readonly_session() as session:
             query = select(AlertHistory).where(AlertHistory.user_id == user_id)
             if unread_only: query = query.where(AlertHistory.is_read == False)
             if device_id: query = query.where(AlertHistory.device_id == device_id)
@@ -531,21 +915,20 @@ class DatabaseService:
             return result.scalars().all()
     
     async def get_unread_alerts(self, user_id: int, limit: int = 50) -> List[AlertHistory]:
-        return await self.get_user_alerts(user_id, unread_only=True, limit=limit)
+        async with self.get_readonly_session() as session:
+            result = await session.execute(
+                select(AlertHistory)
+                .where(and_(AlertHistory.user_id == user_id, AlertHistory.is_read == False))
+                .order_by(AlertHistory.created_at.desc())
+                .limit(limit)
+            )
+            return result.scalars().all()
 
     async def mark_alert_read(self, alert_id: int) -> bool:
         async with self.get_session() as session:
             result = await session.execute(update(AlertHistory).where(AlertHistory.id == alert_id).values(is_read=True, read_at=datetime.utcnow()))
             return result.rowcount > 0
 
-    async def delete_alert(self, alert_id: int) -> bool:
-        """Delete an alert from history permanently"""
-        async with self.get_session() as session:
-            result = await session.execute(
-                delete(AlertHistory).where(AlertHistory.id == alert_id)
-            )
-            return result.rowcount > 0
-
     async def enqueue_command(self, command_data: CommandCreate) -> CommandQueue:
         async with self.get_session() as session:
             command = CommandQueue(
@@ -562,16 +945,16 @@ class DatabaseService:
         return await self.enqueue_command(command_data)
 
     async def get_pending_commands(self, device_id: int) -> List[CommandQueue]:
-        async with self.get_session() as session:
-            result = await session.execute(select(CommandQueue).where(and_(CommandQueue.device_id == device_id, CommandQueue.status == 'pending')).order_by(CommandQueue.created_at))
+        async with self.get_readonly_session() as session:
+            result = await session.execute(_PENDING_COMMANDS_STMT, {'device_id': device_id})
             return result.scalars().all()
 
-    async def mark_command_sent(self, command_id: int):
+    async def mark_commands_sent(self, command_ids: List[int]):
         async with self.get_session() as session:
-            await session.execute(update(CommandQueue).where(CommandQueue.id == command_id).values(status='sent', sent_at=datetime.utcnow()))
+            await session.execute(update(CommandQueue).where(CommandQueue.id.in_(command_ids)).values(status='sent', sent_at=datetime.utcnow()))
             
     async def get_command(self, command_id: int) -> Optional[CommandQueue]:
-        async with self.get_session() as session:
+        async with self.get_readonly_session() as session:
             result = await session.execute(select(CommandQueue).where(CommandQueue.id == command_id))
             return result.scalar_one_or_none()
 
@@ -586,7 +969,7 @@ class DatabaseService:
         Returns:
             List of CommandQueue objects ordered by creation time (newest first)
         """
-        async with self.get_session() as session:
+        async with self.get_readonly_session() as session:
             query = select(CommandQueue).where(CommandQueue.device_id == device_id)
             
             if status:
@@ -599,7 +982,7 @@ class DatabaseService:
 
     async def get_all_active_devices_with_state(self) -> List[tuple[Device, DeviceState]]:
         """Returns all active devices alongside their state, regardless of online status."""
-        async with self.get_session() as session:
+        async with self.get_readonly_session() as session:
             result = await session.execute(
                 select(Device, DeviceState)
                 .join(DeviceState, Device.id == DeviceState.device_id)
@@ -608,38 +991,78 @@ class DatabaseService:
             )
             return [(device, state) for device, state in result.all()]
 
+    async def get_offline_devices(self) -> List[tuple[Device, DeviceState]]:
+        """Active devices still flagged online whose last report is older than their offline timeout."""
+        timeout_hours = func.coalesce(Device.config['offline_timeout_hours'].astext.cast(Integer), 24)
+        async with self.get_readonly_session() as session:
+            result = await session.execute(
+                select(Device, DeviceState)
+                .join(DeviceState, Device.id == DeviceState.device_id)
+                .where(
+                    Device.is_active == True,
+                    DeviceState.is_online,
+                    DeviceState.last_update < func.timezone('utc', func.now()) - func.make_interval(0, 0, 0, 0, timeout_hours),
+                )
+            )
+            return [(device, state) for device, state in result.all()]
+
     async def mark_device_offline(self, device_id: int):
         async with self.get_session() as session:
             await session.execute(update(DeviceState).where(DeviceState.device_id == device_id).values(is_online=False))
+        self._state_cache.pop(device_id, None)
 
     async def get_device_statistics(self, device_id: int, start_date: datetime, end_date: datetime) -> Optional[Dict[str, Any]]:
-        device = await self.get_device(device_id)
-        if not device: return None
-        
         if start_date.tzinfo: start_date = start_date.astimezone(timezone.utc).replace(tzinfo=None)
         if end_date.tzinfo: end_date = end_date.astimezone(timezone.utc).replace(tzinfo=None)
         
-        trips = await self.get_device_trips(device_id, start_date, end_date)
-        total_dist = sum(t.distance_km for t in trips)
-        avg_speeds = [t.avg_speed for t in trips if t.avg_speed]
-        max_speeds = [t.max_speed for t in trips if t.max_speed]
-        
-        async with self.get_session() as session:
-            idle_count = await session.execute(select(func.count(PositionRecord.id)).where(and_(PositionRecord.device_id == device_id, PositionRecord.device_time >= start_date, PositionRecord.device_time <= end_date, PositionRecord.ignition == True, PositionRecord.speed < 1.0)))
-            total_idle = idle_count.scalar() or 0
+        # Existence check and aggregation are independent; run them on separate pooled connections
+        exists, aggregates = await asyncio.gather(
+            self._device_exists(device_id),
+            self._get_trip_aggregates(device_id, start_date, end_date),
+        )
+        if not exists: return None
+        total_dist, total_trips, avg_speed, max_speed, driving_minutes, total_idle = aggregates
         
         return {
             "device_id": device_id,
             "total_distance_km": round(total_dist, 2),
-            "total_trips": len(trips),
-            "avg_speed": round(sum(avg_speeds)/len(avg_speeds), 1) if avg_speeds else 0,
-            "max_speed": round(max(max_speeds), 1) if max_speeds else 0,
-            "total_idle_time_minutes": total_idle,
-            "total_driving_time_minutes": sum(t.duration_minutes for t in trips if t.duration_minutes),
+            "total_trips": total_trips,
+            "avg_speed": round(float(avg_speed), 1) if avg_speed else 0,
+            "max_speed": round(max_speed, 1) if max_speed else 0,
+            "total_idle_time_minutes": total_idle or 0,
+            "total_driving_time_minutes": driving_minutes,
             "period_start": start_date,
             "period_end": end_date
         }
 
+    async def _device_exists(self, device_id: int) -> bool:
+        async with self.get_readonly_session() as session:
+            result = await session.execute(select(Device.id).where(Device.id == device_id))
+            return result.scalar_one_or_none() is not None
+
+    async def _get_trip_aggregates(self, device_id: int, start_date: datetime, end_date: datetime) -> Row:
+        trip_filter = and_(Trip.device_id == device_id, Trip.start_time >= start_date, Trip.start_time <= end_date)
+        idle_count = (
+            select(func.count(PositionRecord.id))
+            .where(and_(PositionRecord.device_id == device_id, PositionRecord.device_time >= start_date, PositionRecord.device_time <= end_date, PositionRecord.ignition == True, PositionRecord.speed < 1.0))
+            .scalar_subquery()
+        )
+        
+        # One round-trip: trip aggregates plus the idle count as a scalar subquery.
+        # NULLIF keeps zero speeds out of avg/max, matching the previous truthiness filter.
+        async with self.get_readonly_session() as session:
+            result = await session.execute(
+                select(
+                    func.coalesce(func.sum(Trip.distance_km), 0.0),
+                    func.count(Trip.id),
+                    func.avg(func.nullif(Trip.avg_speed, 0)),
+                    func.max(func.nullif(Trip.max_speed, 0)),
+                    func.coalesce(func.sum(Trip.duration_minutes), 0),
+                    idle_count,
+                ).where(trip_filter)
+            )
+            return result.one()
+
     async def update_device_alert_state(self, device_id: int, alert_states: Dict[str, Any]):
         async with self.get_session() as session:
             await session.execute(
@@ -647,9 +1070,10 @@ class DatabaseService:
                 .where(DeviceState.device_id == device_id)
                 .values(alert_states=alert_states)
             )
+        self._state_cache.pop(device_id, None)
 
     async def get_user_by_username(self, username: str) -> Optional[User]:
-        async with self.get_session() as session:
+        async with self.get_readonly_session() as session:
             result = await session.execute(
                 select(User).where(User.username == username)
             )
@@ -666,8 +1090,7 @@ async def init_database(database_url: str) -> DatabaseService:
     return db_service
 
 def get_db() -> DatabaseService:
-    if db_service is None:
-        raise RuntimeError("Database not initialized.")
+    """Return the service set up by init_database() during app startup."""
     return db_service
 
 
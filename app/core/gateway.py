@@ -4,31 +4,75 @@ High-performance async network handlers for GPS device connections
 """
 import asyncio
 import logging
+import socket
 import struct
+from collections import OrderedDict
 from typing import Dict, Optional, Callable, Any
 from datetime import datetime
 
+from core.config import get_settings
 from protocols import ProtocolRegistry
 from models.schemas import NormalizedPosition
 
 logger = logging.getLogger(__name__)
 
+# Preallocated receive area, shared by a server's connections where the loop allows
+TCP_RECV_BUFFER_SIZE = 65536
+# Stop reading from a socket while this many undecoded bytes are queued
+TCP_MAX_PENDING_BYTES = 256 * 1024
+# Close a TCP connection after this many seconds without incoming data
+TCP_IDLE_TIMEOUT = 300.0
+# Datagrams drained per UDP socket wakeup, and the largest accepted datagram
+UDP_BATCH_SIZE = 64
+UDP_MAX_DATAGRAM_SIZE = 65535
+# Datagrams waiting for decode before new ones are dropped
+UDP_QUEUE_SIZE = 10000
+# Outgoing bytes buffered per TCP connection before drain() waits
+TCP_WRITE_BUFFER_HIGH = 64 * 1024
+# A device that cannot take a command within this many seconds is dropped
+COMMAND_WRITE_TIMEOUT = 5.0
+# Connects/disconnects are summarised at INFO once per interval instead of per event
+CONNECTION_SUMMARY_INTERVAL = 10.0
+
 
 class DeviceConnectionManager:
-    """Manages active device connections"""
-    def __init__(self):
-        self.connections: Dict[str, asyncio.StreamWriter] = {}
+    """Manages active device connections, oldest first, capped at max_connections"""
+    def __init__(self, max_connections: int):
+        self.max_connections = max_connections
+        self.connections: OrderedDict[str, asyncio.StreamWriter] = OrderedDict()
         self.imei_to_protocol: Dict[str, str] = {}
+        self.connected_count = 0
+        self.disconnected_count = 0
     
     def register_connection(self, imei: str, protocol: str, writer: asyncio.StreamWriter):
+        old = self.connections.get(imei)
+        if old is writer:
+            # Already registered; frames carrying the IMEI re-register every time
+            self.connections.move_to_end(imei)
+            return
+        if old is not None:
+            # Device reconnected before the old socket was noticed dead
+            old.close()
         self.connections[imei] = writer
+        self.connections.move_to_end(imei)
         self.imei_to_protocol[imei] = protocol
-        logger.info(f"Device connected: {imei} ({protocol})")
+        self.connected_count += 1
+        logger.debug("Device connected: %s (%s)", imei, protocol)
+
+        while len(self.connections) > self.max_connections:
+            stale_imei, stale_writer = self.connections.popitem(last=False)
+            self.imei_to_protocol.pop(stale_imei, None)
+            stale_writer.close()
+            logger.warning(f"Connection limit reached, closed oldest session: {stale_imei}")
     
-    def unregister_connection(self, imei: str):
-        if imei in self.connections:
+    def unregister_connection(self, imei: str, writer: Optional[asyncio.StreamWriter] = None):
+        # Only drop the entry if it still belongs to this session; a reconnect may have replaced it
+        current = self.connections.get(imei)
+        if current is not None and (writer is None or current is writer):
             del self.connections[imei]
-            logger.info(f"Device disconnected: {imei}")
+            self.imei_to_protocol.pop(imei, None)
+            self.disconnected_count += 1
+            logger.debug("Device disconnected: %s", imei)
     
     def get_connection(self, imei: str) -> Optional[asyncio.StreamWriter]:
         return self.connections.get(imei)
@@ -36,7 +80,22 @@ class DeviceConnectionManager:
     def is_online(self, imei: str) -> bool:
         return imei in self.connections
 
-connection_manager = DeviceConnectionManager()
+connection_manager = DeviceConnectionManager(get_settings().max_device_connections)
+
+
+async def connection_summary_task():
+    """Log connection churn once per CONNECTION_SUMMARY_INTERVAL while there is any."""
+    while True:
+        await asyncio.sleep(CONNECTION_SUMMARY_INTERVAL)
+        connected = connection_manager.connected_count
+        disconnected = connection_manager.disconnected_count
+        if connected or disconnected:
+            connection_manager.connected_count = connection_manager.disconnected_count = 0
+            logger.info(
+                "Devices: %d online, %d connected, %d disconnected in the last %ds",
+                len(connection_manager.connections), connected, disconnected,
+                CONNECTION_SUMMARY_INTERVAL,
+            )
 
 
 class TCPDeviceHandler:
@@ -47,13 +106,11 @@ class TCPDeviceHandler:
     
     def __init__(
         self, 
-        reader: asyncio.StreamReader, 
         writer: asyncio.StreamWriter,
         protocol: str,
         position_callback: Callable,
         command_callback: Optional[Callable] = None
     ):
-        self.reader = reader
         self.writer = writer
         self.protocol = protocol
         self.position_callback = position_callback
@@ -64,94 +121,149 @@ class TCPDeviceHandler:
         self.client_port = peername[1] if peername else 0
         
         self.imei: Optional[str] = None
-        self.buffer = b""
+        self.buffer = bytearray()
+        self._data_ready = asyncio.Event()
+        self._eof = False
+        self._reading_paused = False
+        self._loop = asyncio.get_running_loop()
+        self._last_data = self._loop.time()
+        self._idle_handle: Optional[asyncio.TimerHandle] = None
         self.decoder = ProtocolRegistry.get_decoder(self.protocol)
+        writer.transport.set_write_buffer_limits(high=TCP_WRITE_BUFFER_HIGH)
         
         if not self.decoder:
             logger.error(f"No decoder found for protocol: {self.protocol}")
         
-        logger.info(f"New {self.protocol.upper()} connection from {self.client_ip}:{self.client_port}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("New %s connection from %s:%s", self.protocol.upper(), self.client_ip, self.client_port)
     
+    def feed_data(self, data: memoryview):
+        """Called by the transport protocol with freshly received bytes."""
+        self.buffer.extend(data)
+        self._last_data = self._loop.time()
+        self._data_ready.set()
+        if not self._reading_paused and len(self.buffer) > TCP_MAX_PENDING_BYTES:
+            # Decoder is falling behind; let TCP back-pressure the device
+            self._reading_paused = True
+            self.writer.transport.pause_reading()
+
+    def feed_eof(self):
+        self._eof = True
+        self._data_ready.set()
+
+    def _check_idle(self):
+        # One timer per connection: feed_data only stamps the time, and the
+        # timer re-arms itself for the remaining interval until it expires
+        deadline = self._last_data + TCP_IDLE_TIMEOUT
+        if self._loop.time() >= deadline:
+            self._idle_handle = None
+            self.feed_eof()
+        else:
+            self._idle_handle = self._loop.call_at(deadline, self._check_idle)
+
+    async def _flush_writes(self, pending_writes: list):
+        if pending_writes:
+            self.writer.writelines(pending_writes)
+            pending_writes.clear()
+            await self.writer.drain()
+
+    def _register(self, imei: str):
+        self.imei = imei
+        connection_manager.register_connection(imei, self.protocol, self.writer)
+
+    async def _handle_event(self, result: dict, pending_writes: list):
+        imei = result.get("imei")
+        if imei:
+            self._register(imei)
+            if self.command_callback:
+                # Keep wire order: earlier ACKs before queued commands
+                await self._flush_writes(pending_writes)
+                await self.command_callback(imei, self.writer)
+
+        response = result.get("response")
+        if response:
+            pending_writes.append(response)
+
+        # Some protocols (Teltonika, Meitrack, OsmAnd) return a
+        # position embedded in the dict alongside a response
+        pos = result.get("position")
+        if pos is not None:
+            await self._handle_position(pos, pending_writes)
+
+        # Teltonika multi-record: process any additional positions
+        for extra_pos in result.get("extra_positions", ()):
+            await self.position_callback(extra_pos)
+
+    async def _handle_position(self, pos: NormalizedPosition, pending_writes: list):
+        if not self.imei and pos.imei:
+            self._register(pos.imei)
+        await self.position_callback(pos)
+
     async def handle(self):
         if not self.decoder:
             self.writer.close()
             return
 
+        # Resolved once per connection rather than per frame
+        dispatch = {dict: self._handle_event, NormalizedPosition: self._handle_position}
+        decode = self.decoder.decode
+        buffer = self.buffer
+        client_info = {"ip": self.client_ip, "port": self.client_port}
+        flush_writes = self._flush_writes
+        self._idle_handle = self._loop.call_at(self._last_data + TCP_IDLE_TIMEOUT, self._check_idle)
+
         try:
             while True:
                 try:
-                    # Read new chunk
-                    chunk = await asyncio.wait_for(self.reader.read(4096), timeout=300.0)
-                    if not chunk: break
-                    self.buffer += chunk
+                    # Wait for the protocol to deliver new bytes (or EOF / idle timeout)
+                    await self._data_ready.wait()
+                    self._data_ready.clear()
                     
+                    # ACKs for every frame in this pass go out in one writelines()
+                    pending_writes: list = []
+
                     # Process buffer loop
                     while True:
-                        if not self.buffer: break
+                        if not buffer: break
                         
-                        # Try to decode from current buffer
-                        result, consumed = await self.decoder.decode(
-                            self.buffer,
-                            {"ip": self.client_ip, "port": self.client_port},
-                            self.imei
-                        )
+                        # Decoders get the bytearray itself (no copy); it is only
+                        # trimmed after decode returns
+                        result, consumed = await decode(buffer, client_info, self.imei)
                         
                         if consumed == 0:
                             # Incomplete packet, wait for more data
                             break
                         
-                        # Remove consumed bytes
-                        self.buffer = self.buffer[consumed:]
+                        # Remove consumed bytes in place
+                        del buffer[:consumed]
                         
-                        if not result:
-                            # Packet parsed but no result (e.g. heartbeat or skip)
-                            continue
-                            
-                        # Handle Control Events / mixed results
-                        if isinstance(result, dict):
-                            if "imei" in result:
-                                self.imei = result["imei"]
-                                connection_manager.register_connection(self.imei, self.protocol, self.writer)
-                                if self.command_callback:
-                                    await self.command_callback(self.imei, self.writer)
-
-                            if "response" in result:
-                                self.writer.write(result["response"])
-                                await self.writer.drain()
-
-                            # Some protocols (Teltonika, Meitrack) return a
-                            # position embedded in the dict alongside a response
-                            if "position" in result:
-                                pos = result["position"]
-                                if isinstance(pos, NormalizedPosition):
-                                    if not self.imei and pos.imei:
-                                        self.imei = pos.imei
-                                        connection_manager.register_connection(self.imei, self.protocol, self.writer)
-                                    await self.position_callback(pos)
-
-                            # Teltonika multi-record: process any additional positions
-                            for extra_pos in result.get("extra_positions", []):
-                                if isinstance(extra_pos, NormalizedPosition):
-                                    await self.position_callback(extra_pos)
-
-                        # Handle plain NormalizedPosition
-                        elif isinstance(result, NormalizedPosition):
-                            if not self.imei and result.imei:
-                                self.imei = result.imei
-                                connection_manager.register_connection(self.imei, self.protocol, self.writer)
-
-                            await self.position_callback(result)
+                        # Decoders return a NormalizedPosition or an event dict;
+                        # anything else (None) has nothing to do
+                        handler = dispatch.get(type(result))
+                        if handler is not None:
+                            await handler(result, pending_writes)
+
+                    await flush_writes(pending_writes)
+
+                    # Everything decodable has been handled; an incomplete frame
+                    # needs more bytes, so always resume here
+                    if self._reading_paused:
+                        self._reading_paused = False
+                        self.writer.transport.resume_reading()
+
+                    if self._eof: break
                             
-                except asyncio.TimeoutError:
-                    break # Timeout logic
                 except Exception as e:
                     logger.error(f"Handler error: {e}")
-                    self.buffer = b"" # Reset buffer on error
+                    self.buffer.clear() # Reset buffer on error
                     break
                     
         finally:
+            if self._idle_handle is not None:
+                self._idle_handle.cancel()
+                self._idle_handle = None
             if self.imei:
-                connection_manager.unregister_connection(self.imei)
+                connection_manager.unregister_connection(self.imei, self.writer)
             try:
                 self.writer.close()
                 await self.writer.wait_closed()
@@ -162,18 +274,113 @@ class TCPDeviceHandler:
     # directly in the result dict under the "response" key.
 
 
+class GPSBufferedProtocol(asyncio.BufferedProtocol):
+    """
+    TCP transport protocol that receives straight into a preallocated buffer
+    and hands the bytes to a TCPDeviceHandler, skipping StreamReader's
+    per-chunk bytes objects. Writes still go through a StreamWriter so
+    responses and queued commands keep using write()/drain().
+
+    Write flow control for drain() is implemented here rather than inherited
+    from asyncio.streams.FlowControlMixin: that mixin is an asyncio.Protocol,
+    and uvloop only calls get_buffer()/buffer_updated() on protocols that
+    are not one (it would call the no-op data_received() instead).
+    """
+
+    def __init__(
+        self,
+        protocol: str,
+        position_callback: Callable,
+        command_callback: Optional[Callable] = None,
+        recv_view: Optional[memoryview] = None
+    ):
+        self._loop = asyncio.get_running_loop()
+        self.protocol = protocol
+        self.position_callback = position_callback
+        self.command_callback = command_callback
+        self._recv_view = recv_view if recv_view is not None else memoryview(bytearray(TCP_RECV_BUFFER_SIZE))
+        self._closed = self._loop.create_future()
+        self.handler: Optional[TCPDeviceHandler] = None
+        self._task: Optional[asyncio.Task] = None
+        self._write_paused = False
+        self._drain_waiters: list[asyncio.Future] = []
+        self._connection_lost = False
+
+    def connection_made(self, transport):
+        writer = asyncio.StreamWriter(transport, self, None, self._loop)
+        self.handler = TCPDeviceHandler(writer, self.protocol, self.position_callback, self.command_callback)
+        self._task = self._loop.create_task(self.handler.handle())
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self._recv_view
+
+    def buffer_updated(self, nbytes: int):
+        self.handler.feed_data(self._recv_view[:nbytes])
+
+    def eof_received(self):
+        self.handler.feed_eof()
+        return False
+
+    def pause_writing(self):
+        self._write_paused = True
+
+    def resume_writing(self):
+        self._write_paused = False
+        self._wake_drain_waiters(None)
+
+    def _wake_drain_waiters(self, exc: Optional[Exception]):
+        for waiter in self._drain_waiters:
+            if not waiter.done():
+                if exc is None:
+                    waiter.set_result(None)
+                else:
+                    waiter.set_exception(exc)
+
+    async def _drain_helper(self):
+        # Awaited by StreamWriter.drain()
+        if self._connection_lost:
+            raise ConnectionResetError('Connection lost')
+        if not self._write_paused:
+            return
+        waiter = self._loop.create_future()
+        self._drain_waiters.append(waiter)
+        try:
+            await waiter
+        finally:
+            self._drain_waiters.remove(waiter)
+
+    def connection_lost(self, exc):
+        self._connection_lost = True
+        if self._write_paused:
+            self._wake_drain_waiters(exc)
+        if self.handler:
+            self.handler.feed_eof()
+        if not self._closed.done():
+            self._closed.set_result(None)
+
+    def _get_close_waiter(self, stream):
+        return self._closed
+
+
 class TCPServer:
     def __init__(self, host: str, port: int, protocol: str, position_callback: Callable, command_callback: Optional[Callable] = None):
         self.host = host; self.port = port; self.protocol = protocol
         self.position_callback = position_callback; self.command_callback = command_callback
         self.server = None
     
-    async def _handle_client(self, reader, writer):
-        handler = TCPDeviceHandler(reader, writer, self.protocol, self.position_callback, self.command_callback)
-        await handler.handle()
-    
     async def start(self):
-        self.server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        loop = asyncio.get_running_loop()
+        # Selector loops (asyncio's default, uvloop) call get_buffer() and
+        # buffer_updated() back to back, and feed_data() copies the bytes out,
+        # so all connections can share one receive area. Proactor loops hold the
+        # buffer across an overlapped read and need one per connection.
+        recv_view = None
+        if not isinstance(loop, getattr(asyncio, "ProactorEventLoop", ())):
+            recv_view = memoryview(bytearray(TCP_RECV_BUFFER_SIZE))
+        self.server = await loop.create_server(
+            lambda: GPSBufferedProtocol(self.protocol, self.position_callback, self.command_callback, recv_view),
+            self.host, self.port
+        )
         logger.info(f"{self.protocol.upper()} TCP Server started on {self.host}:{self.port}")
         async with self.server: await self.server.serve_forever()
 
@@ -182,38 +389,106 @@ class UDPProtocol(asyncio.DatagramProtocol):
     def __init__(self, protocol: str, position_callback: Callable):
         self.protocol = protocol; self.position_callback = position_callback
         self.decoder = ProtocolRegistry.get_decoder(protocol)
+        # One long-lived worker drains this queue instead of a task per datagram
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=UDP_QUEUE_SIZE)
+        self._worker: Optional[asyncio.Task] = None
+
+    def connection_made(self, transport):
+        self.start_worker()
+
+    def start_worker(self):
+        if self._worker is None:
+            self._worker = asyncio.get_running_loop().create_task(self._run())
 
     def datagram_received(self, data: bytes, addr):
-        asyncio.create_task(self._process(data, addr))
+        try:
+            self._queue.put_nowait((data, addr))
+        except asyncio.QueueFull:
+            logger.warning(f"{self.protocol.upper()} UDP queue full, dropping datagram from {addr[0]}")
+
+    async def _run(self):
+        while True:
+            data, addr = await self._queue.get()
+            await self._process(data, addr)
 
     async def _process(self, data: bytes, addr):
         if not self.decoder: return
         try:
             # UDP doesn't use buffer consumption logic same way, it's 1 packet per datagram
-            res, _ = await self.decoder.decode(data, {"ip": addr[0], "port": addr[1]}, None)
+            client_info = {"ip": addr[0], "port": addr[1]}
+            decoded = self.decoder.decode_sync(data, client_info, None)
+            if decoded is None:
+                decoded = await self.decoder.decode(data, client_info, None)
+            res, _ = decoded
             if isinstance(res, NormalizedPosition): await self.position_callback(res)
         except: pass
 
 
+class UDPBatchReader(UDPProtocol):
+    """
+    Reads datagrams straight off a non-blocking socket from a loop reader
+    callback, draining up to UDP_BATCH_SIZE per wakeup into one reused buffer.
+    Datagrams go to the shared decode worker, in arrival order.
+    """
+
+    def __init__(self, protocol: str, position_callback: Callable, sock: socket.socket):
+        super().__init__(protocol, position_callback)
+        self.sock = sock
+        self._recv_view = memoryview(bytearray(UDP_MAX_DATAGRAM_SIZE))
+        self.start_worker()
+
+    def drain(self):
+        for _ in range(UDP_BATCH_SIZE):
+            try:
+                nbytes, addr = self.sock.recvfrom_into(self._recv_view)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                logger.warning(f"{self.protocol.upper()} UDP receive error: {e}")
+                break
+            self.datagram_received(bytes(self._recv_view[:nbytes]), addr)
+
+
 class UDPServer:
     def __init__(self, host: str, port: int, protocol: str, position_callback: Callable):
         self.host = host; self.port = port; self.protocol = protocol; self.position_callback = position_callback
+        self.sock: Optional[socket.socket] = None
 
     async def start(self):
-        loop = asyncio.get_event_loop()
-        await loop.create_datagram_endpoint(
-            lambda: UDPProtocol(self.protocol, self.position_callback),
-            local_addr=(self.host, self.port)
-        )
+        loop = asyncio.get_running_loop()
+        family, _, _, _, addr = (await loop.getaddrinfo(self.host, self.port, type=socket.SOCK_DGRAM))[0]
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.sock.bind(addr)
+
+        try:
+            reader = UDPBatchReader(self.protocol, self.position_callback, self.sock)
+            loop.add_reader(self.sock.fileno(), reader.drain)
+        except NotImplementedError:
+            # Event loops without add_reader (e.g. Windows proactor)
+            await loop.create_datagram_endpoint(
+                lambda: UDPProtocol(self.protocol, self.position_callback),
+                sock=self.sock
+            )
         logger.info(f"{self.protocol.upper()} UDP Server started on {self.host}:{self.port}")
 
+async def write_command(imei: str, writer: asyncio.StreamWriter, command_data: bytes) -> bool:
+    """Write a command and wait for it to drain; a device too slow to accept it is disconnected."""
+    writer.write(command_data)
+    try:
+        await asyncio.wait_for(writer.drain(), timeout=COMMAND_WRITE_TIMEOUT)
+        return True
+    except asyncio.TimeoutError:
+        logger.warning(f"Command write to {imei} timed out, dropping connection")
+        writer.transport.abort()
+        connection_manager.unregister_connection(imei, writer)
+        return False
+
 async def send_command_to_device(imei: str, command_data: bytes) -> bool:
     writer = connection_manager.get_connection(imei)
     if not writer: return False
     try:
-        writer.write(command_data)
-        await writer.drain()
-        return True
+        return await write_command(imei, writer, command_data)
     except: return False
 
 def get_online_devices() -> list:
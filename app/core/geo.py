@@ -0,0 +1,52 @@
+"""
+Geo helpers
+In-process distance math for position tracks
+"""
+import math
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def _haversine_total_numpy(lat: np.ndarray, lon: np.ndarray) -> float:
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    a = (
+        np.sin(np.diff(lat) / 2) ** 2
+        + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2
+    )
+    return float(2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a)).sum())
+
+
+if njit is not None:
+    # Single fused pass with no temporary arrays. The explicit signature
+    # compiles at import (from the on-disk cache after the first run), so
+    # no request pays the JIT cost.
+    @njit("float64(float64[:], float64[:])", cache=True, fastmath=True)
+    def _haversine_total_kernel(lat, lon):
+        total = 0.0
+        for i in range(1, lat.shape[0]):
+            lat1 = math.radians(lat[i - 1])
+            lat2 = math.radians(lat[i])
+            dlat = lat2 - lat1
+            dlon = math.radians(lon[i] - lon[i - 1])
+            a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+            total += 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+        return total
+else:
+    _haversine_total_kernel = _haversine_total_numpy
+
+
+def haversine_total_km(latitudes, longitudes) -> float:
+    """Length in km of the track through the given points (degrees), on a spherical Earth."""
+    lat = np.asarray(latitudes, dtype=np.float64)
+    lon = np.asarray(longitudes, dtype=np.float64)
+    if lat.shape[0] < 2:
+        return 0.0
+    return float(_haversine_total_kernel(lat, lon))
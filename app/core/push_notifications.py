@@ -3,11 +3,14 @@ Push Notification Service (Web Push / VAPID)
 File location: app/core/push_notifications.py
 """
 
+import asyncio
 import json
 import logging
-from typing import Optional
+import time
+from typing import Optional, List
+from urllib.parse import urlparse
 
-from sqlalchemy import select, delete
+from sqlalchemy import select, delete, func, bindparam
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 from models.models import Base
@@ -20,6 +23,47 @@ from core.config import get_settings
 
 logger = logging.getLogger(__name__)
 
+try:
+    import orjson
+
+    def _dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+
+
+_SEVERITY_EMOJI = {"critical": "🚨", "high": "⚠️", "warning": "⚠️", "info": "ℹ️"}
+_DEFAULT_EMOJI = "🔔"
+_ICON_URL = "/icons/icon-192.png"
+_CLICK_URL = "/gps-dashboard.html"
+_SEND_TIMEOUT_SECONDS = 10
+# Connection pool for push-service origins (FCM, Mozilla autopush, ...)
+_HTTP_MAX_CONNECTIONS = 100
+_HTTP_MAX_PER_HOST = 50
+_HTTP_KEEPALIVE_SECONDS = 60
+# VAPID tokens are signed per push-service origin and reused until close to expiry
+_VAPID_TOKEN_TTL = 12 * 60 * 60
+_VAPID_REFRESH_MARGIN = 60 * 60
+
+# alert_type -> display title / notification tag; alert types are a small fixed set
+_TITLE_CACHE: dict[str, str] = {}
+_TAG_CACHE: dict[str, str] = {}
+
+
+def _title_for(alert_type: str) -> str:
+    title = _TITLE_CACHE.get(alert_type)
+    if title is None:
+        title = _TITLE_CACHE[alert_type] = alert_type.replace('_', ' ').title()
+    return title
+
+
+def _tag_for(alert_type: str) -> str:
+    tag = _TAG_CACHE.get(alert_type)
+    if tag is None:
+        tag = _TAG_CACHE[alert_type] = f"gps-alert-{alert_type}"
+    return tag
+
 
 # ── SQLAlchemy Model ──────────────────────────────────────────────
 
@@ -27,11 +71,28 @@ class PushSubscription(Base):
     """Stores browser Web Push subscription objects per user."""
     __tablename__ = "push_subscriptions"
 
-    id:           Mapped[int]      = mapped_column(Integer, primary_key=True)
-    user_id:      Mapped[int]      = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"), unique=True, nullable=False)
+    # One subscription per user, so the user id is the key
+    user_id:      Mapped[int]      = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
     subscription: Mapped[dict]     = mapped_column(JSONB, nullable=False)
     created_at:   Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
-    updated_at:   Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Stamped by Postgres on insert; upserts set it explicitly
+    updated_at:   Mapped[datetime] = mapped_column(DateTime, server_default=func.timezone('utc', func.now()))
+
+
+# Built once; the conflict branch reuses the inserted row's values via EXCLUDED
+_UPSERT_SUBSCRIPTION_STMT = pg_insert(PushSubscription).values(
+    user_id=bindparam('p_user_id'),
+    subscription=bindparam('p_subscription', type_=JSONB),
+    created_at=bindparam('p_now'),
+    updated_at=bindparam('p_now'),
+)
+_UPSERT_SUBSCRIPTION_STMT = _UPSERT_SUBSCRIPTION_STMT.on_conflict_do_update(
+    index_elements=[PushSubscription.user_id],
+    set_={
+        "subscription": _UPSERT_SUBSCRIPTION_STMT.excluded.subscription,
+        "updated_at": _UPSERT_SUBSCRIPTION_STMT.excluded.updated_at,
+    },
+)
 
 
 # ── Service ───────────────────────────────────────────────────────
@@ -41,11 +102,16 @@ class PushNotificationService:
 
     def __init__(self):
         settings = get_settings()
-        self._private_key = getattr(settings, 'vapid_private_key', '')
-        self._public_key  = getattr(settings, 'vapid_public_key', '')
-        self._mailto      = getattr(settings, 'vapid_mailto', 'mailto:admin@example.com')
+        self._private_key = settings.vapid_private_key
+        self._public_key  = settings.vapid_public_key
+        self._mailto      = settings.vapid_mailto
         if not self._private_key:
             logger.warning("[Push] VAPID keys not configured — push notifications disabled")
+        # Shared HTTP session so pushes reuse connections to the push services
+        self._http = None
+        self._vapid = None
+        # audience (scheme://host) -> (signed headers, exp epoch)
+        self._vapid_cache: dict[str, tuple[dict, int]] = {}
 
     @property
     def _enabled(self) -> bool:
@@ -63,31 +129,46 @@ class PushNotificationService:
         device_name: Optional[str] = None,
         alert_id: Optional[int] = None,
     ) -> bool:
-        if not self._enabled:
-            return False
-        subscription = await self._get_subscription(db_service, user_id)
-        if not subscription:
-            return False
-        return await self._send(
-            subscription=subscription,
-            alert_type=alert_type,
-            message=message,
-            severity=severity,
-            device_name=device_name,
-            alert_id=alert_id,
+        sent = await self.notify_users(
+            db_service, [user_id], alert_type, message,
+            severity=severity, device_name=device_name, alert_id=alert_id,
+        )
+        return sent > 0
+
+    async def notify_users(
+        self,
+        db_service,
+        user_ids: List[int],
+        alert_type: str,
+        message: str,
+        severity: str = "info",
+        device_name: Optional[str] = None,
+        alert_id: Optional[int] = None,
+    ) -> int:
+        """Push one alert to several users: one query, one payload, concurrent sends. Returns sends that succeeded."""
+        if not self._enabled or not user_ids:
+            return 0
+        subscriptions = await self._get_subscriptions(db_service, user_ids)
+        if not subscriptions:
+            return 0
+
+        title, payload = self._build_payload(alert_type, message, severity, device_name, alert_id)
+        results = await asyncio.gather(
+            *[self._send(subscription, title, payload) for subscription in subscriptions],
+            return_exceptions=True,
         )
+        return sum(1 for ok in results if ok is True)
+
+    async def close(self):
+        if self._http is not None and not self._http.closed:
+            await self._http.close()
 
     async def save_subscription(self, db_service, user_id: int, subscription: dict):
         async with db_service.get_session() as session:
-            stmt = pg_insert(PushSubscription).values(
-                user_id=user_id,
-                subscription=subscription,
-                updated_at=datetime.utcnow(),
-            ).on_conflict_do_update(
-                index_elements=["user_id"],
-                set_={"subscription": subscription, "updated_at": datetime.utcnow()},
+            await session.execute(
+                _UPSERT_SUBSCRIPTION_STMT,
+                {"p_user_id": user_id, "p_subscription": subscription, "p_now": datetime.utcnow()},
             )
-            await session.execute(stmt)
 
     async def remove_subscription(self, db_service, user_id: int):
         async with db_service.get_session() as session:
@@ -97,55 +178,91 @@ class PushNotificationService:
 
     # ── Internal ──────────────────────────────────────────────────
 
-    async def _get_subscription(self, db_service, user_id: int) -> Optional[dict]:
-        async with db_service.get_session() as session:
+    async def _get_subscriptions(self, db_service, user_ids: List[int]) -> List[dict]:
+        async with db_service.get_readonly_session() as session:
             result = await session.execute(
-                select(PushSubscription).where(PushSubscription.user_id == user_id)
+                select(PushSubscription.subscription).where(PushSubscription.user_id.in_(user_ids))
             )
-            row = result.scalar_one_or_none()
-            return row.subscription if row else None
+            return list(result.scalars())
 
-    async def _send(
+    def _build_payload(
         self,
-        subscription: dict,
         alert_type: str,
         message: str,
         severity: str,
         device_name: Optional[str],
         alert_id: Optional[int],
-    ) -> bool:
-        try:
-            from pywebpush import webpush, WebPushException
-        except ImportError:
-            logger.error("[Push] pywebpush not installed. Run: pip install pywebpush")
-            return False
-
-        severity_emoji = {"critical": "🚨", "high": "⚠️", "warning": "⚠️", "info": "ℹ️"}.get(severity, "🔔")
-        title = f"{severity_emoji} {device_name + ': ' if device_name else ''}{alert_type.replace('_', ' ').title()}"
+    ) -> tuple[str, bytes]:
+        severity_emoji = _SEVERITY_EMOJI.get(severity, _DEFAULT_EMOJI)
+        title = f"{severity_emoji} {device_name + ': ' if device_name else ''}{_title_for(alert_type)}"
 
-        payload = json.dumps({
+        # pywebpush takes bytes as-is, so the encoded payload goes straight through
+        payload = _dumps({
             "title":    title,
             "body":     message,
             "severity": severity,
-            "tag":      f"gps-alert-{alert_type}",
-            "icon":     "/icons/icon-192.png",
-            "badge":    "/icons/icon-192.png",
-            "data":     {"url": "/gps-dashboard.html", "alert_id": alert_id},
+            "tag":      _tag_for(alert_type),
+            "icon":     _ICON_URL,
+            "badge":    _ICON_URL,
+            "data":     {"url": _CLICK_URL, "alert_id": alert_id},
         })
+        return title, payload
+
+    def _get_http(self):
+        import aiohttp
+        if self._http is None or self._http.closed:
+            connector = aiohttp.TCPConnector(
+                limit=_HTTP_MAX_CONNECTIONS,
+                limit_per_host=_HTTP_MAX_PER_HOST,
+                keepalive_timeout=_HTTP_KEEPALIVE_SECONDS,
+            )
+            self._http = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=_SEND_TIMEOUT_SECONDS),
+            )
+        return self._http
+
+    def _vapid_headers(self, endpoint: str) -> dict:
+        """Signed VAPID Authorization header for the endpoint's origin, re-signed only near expiry."""
+        url = urlparse(endpoint)
+        audience = f"{url.scheme}://{url.netloc}"
+        now = int(time.time())
+        cached = self._vapid_cache.get(audience)
+        if cached and cached[1] - _VAPID_REFRESH_MARGIN > now:
+            return cached[0]
+
+        if self._vapid is None:
+            from py_vapid import Vapid
+            self._vapid = Vapid.from_string(private_key=self._private_key)
+        exp = now + _VAPID_TOKEN_TTL
+        headers = self._vapid.sign({"sub": self._mailto, "aud": audience, "exp": exp})
+        self._vapid_cache[audience] = (headers, exp)
+        return headers
+
+    async def _send(self, subscription: dict, title: str, payload: bytes) -> bool:
+        try:
+            from pywebpush import webpush_async
+        except ImportError:
+            logger.error("[Push] pywebpush not installed. Run: pip install pywebpush")
+            return False
 
         try:
-            webpush(
+            # No vapid_claims: pywebpush would otherwise parse the key and sign a JWT per call
+            await webpush_async(
                 subscription_info=subscription,
                 data=payload,
-                vapid_private_key=self._private_key,
-                vapid_claims={"sub": self._mailto},
+                headers=self._vapid_headers(subscription["endpoint"]),
+                aiohttp_session=self._get_http(),
+                # pywebpush always passes its own timeout to post(), which would
+                # override the session's ClientTimeout (None = no limit at all)
+                timeout=_SEND_TIMEOUT_SECONDS,
             )
-            logger.info(f"[Push] Sent: {title}")
+            logger.debug("[Push] Sent: %s", title)
             return True
 
         except Exception as ex:
             response = getattr(ex, "response", None)
-            if response and response.status_code == 410:
+            if response is not None and getattr(response, "status", None) == 410:
                 logger.info("[Push] Subscription expired (410)")
             else:
                 logger.error(f"[Push] Send failed: {ex}")
@@ -0,0 +1,59 @@
+"""
+Response Cache
+JSON responses encoded straight with orjson, bypassing response_model
+validation, plus a short-lived per-device cache for endpoints that
+dashboards poll (trips, statistics). Cache entries expire after a TTL and
+are dropped as soon as a new position for the device is processed.
+"""
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Sequence, Tuple
+
+import orjson
+from fastapi import Response
+
+RESPONSE_CACHE_TTL = 30.0
+# Devices with cached responses before the oldest are evicted
+RESPONSE_CACHE_MAX_DEVICES = 10000
+
+# device_id -> {key: (expires_at, body)}
+_cache: Dict[int, Dict[Hashable, Tuple[float, bytes]]] = {}
+
+
+def json_response(body: bytes) -> Response:
+    return Response(content=body, media_type="application/json")
+
+
+def rows_to_json(rows: Iterable[Any], fields: Sequence[str]) -> Response:
+    """Encode the given attributes of each ORM row as a JSON array response."""
+    return json_response(orjson.dumps([{f: getattr(row, f) for f in fields} for row in rows]))
+
+
+async def cached_json(
+    device_id: int,
+    key: Hashable,
+    producer: Callable[[], Awaitable[Any]],
+    ttl: float = RESPONSE_CACHE_TTL,
+) -> Response:
+    """
+    Serve the cached body for (device_id, key), or await producer(), encode
+    its result with orjson and cache it. Returning a Response directly also
+    skips FastAPI's response_model validation.
+    """
+    now = time.monotonic()
+    entries = _cache.get(device_id)
+    if entries is not None:
+        hit = entries.get(key)
+        if hit is not None and hit[0] > now:
+            return json_response(hit[1])
+
+    body = orjson.dumps(await producer())
+    if entries is None:
+        if len(_cache) >= RESPONSE_CACHE_MAX_DEVICES:
+            _cache.pop(next(iter(_cache)))
+        entries = _cache[device_id] = {}
+    entries[key] = (now + ttl, body)
+    return json_response(body)
+
+
+def invalidate_device(device_id: int):
+    _cache.pop(device_id, None)
@@ -4,14 +4,18 @@ Thin entrypoint: app setup, lifespan, WebSocket, and internal callbacks.
 All REST routes live in app/routes/.
 """
 import asyncio
-import json
 import logging
 import signal
+import sys
+import time
 from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from datetime import datetime, timezone
-from typing import Dict, List, Optional, Any
+from functools import lru_cache
+from typing import Dict, List, Optional, Any, Set, Iterable
 
 import jwt
+import orjson
 import redis.asyncio as redis
 import uvicorn
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
@@ -21,9 +25,10 @@ from fastapi.responses import FileResponse
 
 
 from core.config import get_settings
-from core.database import get_db, init_database
+from core.database import DatabaseService, get_db, init_database
 from core.alert_engine import get_alert_engine, periodic_alert_task
-from core.gateway import TCPServer, UDPServer, connection_manager
+from core.resp_cache import invalidate_device
+from core.gateway import TCPServer, UDPServer, connection_manager, connection_summary_task, write_command
 from models import Device, AlertHistory
 from models.schemas import NormalizedPosition, WSMessageType
 from protocols import ProtocolRegistry
@@ -35,24 +40,84 @@ logger = logging.getLogger(__name__)
 
 # ==================== Redis Pub/Sub ====================
 
+# Messages waiting to be published before new ones are dropped
+PUBLISH_QUEUE_SIZE = 10000
+# Most messages sent per pipeline round-trip. Batches form from whatever
+# queued up while the previous pipeline was in flight, so a lone message
+# is never held back waiting for company.
+PUBLISH_BATCH_SIZE = 500
+# Messages waiting for one dashboard socket before new ones are dropped
+WS_OUTBOX_SIZE = 1000
+# Most messages coalesced into one WebSocket frame (sent as a JSON array)
+WS_BATCH_SIZE = 64
+# Position pipeline workers; a device always maps to the same worker, so its fixes stay in order
+POSITION_WORKERS = 8
+# Fixes queued per worker before device connections wait for room
+POSITION_QUEUE_SIZE = 10000
+# Longest shutdown waits for the workers to finish fixes that were already ACKed
+POSITION_DRAIN_TIMEOUT = 30
+
+
 class RedisPubSub:
-    def __init__(self, redis_url: str = None):
+    """
+    Redis client for broadcasts. publish() only enqueues; a single writer
+    task sends queued messages in pipelined batches, so a burst of position
+    updates costs one round-trip per batch instead of one per message.
+    When disabled, nothing connects and the queue is drained in-process by
+    WebSocketManager.relay_local().
+    """
+    def __init__(self, redis_url: str = None, enabled: bool = True):
         self.redis_url = redis_url
+        self.enabled = enabled
         self.redis_client: Optional[redis.Redis] = None
         self.pubsub = None
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=PUBLISH_QUEUE_SIZE)
+        self._writer_task: Optional[asyncio.Task] = None
 
     async def connect(self):
+        if not self.enabled:
+            logger.info("Redis Pub/Sub disabled, broadcasting in-process")
+            return
         if not self.redis_url:
             self.redis_url = get_settings().redis_url
-        self.redis_client = await redis.from_url(self.redis_url, decode_responses=True)
+        # Payloads stay bytes end to end: orjson output in, WebSocket binary frames out
+        self.redis_client = await redis.from_url(self.redis_url, decode_responses=False)
         self.pubsub = self.redis_client.pubsub()
+        self._writer_task = asyncio.create_task(self._run_writer())
         logger.info("Redis connected for Pub/Sub")
 
     async def publish(self, channel: str, message: Dict[str, Any]):
-        if self.redis_client:
-            await self.redis_client.publish(channel, json.dumps(message))
+        # orjson encodes datetimes itself (ISO 8601) and returns bytes, which redis sends as-is
+        await self.publish_raw(channel, orjson.dumps(message))
+
+    async def publish_raw(self, channel: str, data: bytes):
+        """Queue an already-encoded JSON message."""
+        if self.enabled and not self.redis_client:
+            return
+        try:
+            self.queue.put_nowait((channel, data))
+        except asyncio.QueueFull:
+            logger.warning(f"Publish queue full, dropping message for {channel}")
+
+    async def _run_writer(self):
+        queue = self.queue
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < PUBLISH_BATCH_SIZE and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                for channel, data in batch:
+                    pipe.publish(channel, data)
+                await pipe.execute()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Redis publish error ({len(batch)} messages dropped): {e}")
 
     async def close(self):
+        if self._writer_task:
+            self._writer_task.cancel()
         if self.pubsub:
             await self.pubsub.aclose()
         if self.redis_client:
@@ -64,110 +129,333 @@ redis_pubsub = RedisPubSub()
 
 # ==================== WebSocket Manager ====================
 
+@dataclass(slots=True)
+class _PositionFix:
+    """Per-fix payload of a position update; orjson encodes slotted dataclasses natively."""
+    last_latitude: float
+    last_longitude: float
+    last_altitude: Optional[float]
+    satellites: Optional[int]
+    last_speed: Optional[float]
+    last_course: Optional[float]
+    ignition_on: bool
+    last_update: datetime
+
+
+@dataclass(slots=True)
+class _PositionFixWithState(_PositionFix):
+    """Position update for a device with a state row; the dashboard tells the two apart by key presence."""
+    total_odometer: Optional[float]
+    trip_odometer: Optional[float]
+    is_moving: Optional[bool]
+    is_online: Optional[bool]
+
+
+@dataclass(slots=True)
+class _AlertData:
+    id: int
+    type: str
+    severity: str
+    message: str
+    alert_metadata: Optional[Dict[str, Any]]
+    created_at: datetime
+
+
+@lru_cache(maxsize=65536)
+def _position_update_envelope(device_id: int) -> tuple[str, bytes]:
+    """Channel and the fixed JSON prefix of a device's position updates; they depend only on the id."""
+    prefix = b'{"type":%s,"device_id":%d,"data":' % (orjson.dumps(WSMessageType.POSITION_UPDATE.value), device_id)
+    return f"device:{device_id}", prefix
+
+
 class WebSocketManager:
+    """
+    Tracks dashboard sockets and fans Redis messages out to them. All sockets
+    share the one pubsub connection on redis_pubsub; a channel is subscribed
+    while at least one socket wants it. Each socket has its own outbox and
+    writer task, so a slow browser only delays itself, and messages that
+    pile up are sent together as one JSON-array frame.
+    """
     def __init__(self):
-        self.active_connections: Dict[int, List[WebSocket]] = {}
+        self.active_connections: Dict[int, Set[WebSocket]] = {}
+        self.channel_subscribers: Dict[str, Set[WebSocket]] = {}
+        self._outboxes: Dict[WebSocket, asyncio.Queue] = {}
+        self._writers: Dict[WebSocket, asyncio.Task] = {}
+        # Serialises set changes with the SUBSCRIBE/UNSUBSCRIBE they trigger
+        self._subscription_lock = asyncio.Lock()
+        self._has_channels = asyncio.Event()
+        # Broadcast timestamp, encoded once per wall-clock second
+        self._timestamp_second = 0
+        self._timestamp_json = b""
 
     async def connect(self, user_id: int, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.setdefault(user_id, []).append(websocket)
+        self.active_connections.setdefault(user_id, set()).add(websocket)
+        outbox = self._outboxes[websocket] = asyncio.Queue(maxsize=WS_OUTBOX_SIZE)
+        self._writers[websocket] = asyncio.create_task(self._run_socket_writer(websocket, outbox))
         logger.info(f"WebSocket connected for user {user_id}")
 
     def disconnect(self, user_id: int, websocket: WebSocket):
-        if user_id in self.active_connections:
-            if websocket in self.active_connections[user_id]:
-                self.active_connections[user_id].remove(websocket)
-            if not self.active_connections[user_id]:
+        self._outboxes.pop(websocket, None)
+        writer = self._writers.pop(websocket, None)
+        if writer:
+            writer.cancel()
+        sockets = self.active_connections.get(user_id)
+        if sockets is not None:
+            sockets.discard(websocket)
+            if not sockets:
                 del self.active_connections[user_id]
         logger.info(f"WebSocket disconnected for user {user_id}")
 
+    async def subscribe(self, websocket: WebSocket, channels: Iterable[str]):
+        async with self._subscription_lock:
+            new_channels = []
+            for channel in channels:
+                subscribers = self.channel_subscribers.setdefault(channel, set())
+                if not subscribers:
+                    new_channels.append(channel)
+                subscribers.add(websocket)
+            if new_channels and redis_pubsub.enabled:
+                await redis_pubsub.pubsub.subscribe(*new_channels)
+                self._has_channels.set()
+
+    async def unsubscribe(self, websocket: WebSocket, channels: Iterable[str]):
+        async with self._subscription_lock:
+            empty_channels = []
+            for channel in channels:
+                subscribers = self.channel_subscribers.get(channel)
+                if subscribers is None:
+                    continue
+                subscribers.discard(websocket)
+                if not subscribers:
+                    del self.channel_subscribers[channel]
+                    empty_channels.append(channel)
+            if empty_channels and redis_pubsub.enabled:
+                if not self.channel_subscribers:
+                    self._has_channels.clear()
+                await redis_pubsub.pubsub.unsubscribe(*empty_channels)
+
+    async def listen_to_redis(self):
+        """Background task: relay every pub/sub message to the sockets subscribed to its channel."""
+        while True:
+            # listen() ends once nothing is subscribed, so wait for a first channel
+            await self._has_channels.wait()
+            try:
+                async for message in redis_pubsub.pubsub.listen():
+                    if message["type"] == "message":
+                        await self._deliver(message["channel"].decode(), message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Redis listener error: {e}")
+                await asyncio.sleep(1)
+
+    async def relay_local(self):
+        """Background task used instead of listen_to_redis when Redis Pub/Sub is disabled."""
+        queue = redis_pubsub.queue
+        while True:
+            channel, data = await queue.get()
+            try:
+                await self._deliver(channel, data)
+            except Exception as e:
+                logger.error(f"Broadcast relay error: {e}")
+
+    async def _deliver(self, channel: str, data: bytes):
+        subscribers = self.channel_subscribers.get(channel)
+        if not subscribers:
+            return
+        for ws in subscribers:
+            outbox = self._outboxes.get(ws)
+            if outbox is None:
+                continue
+            try:
+                outbox.put_nowait(data)
+            except asyncio.QueueFull:
+                logger.warning(f"WebSocket outbox full, dropping message for {channel}")
+
+    @staticmethod
+    async def _run_socket_writer(websocket: WebSocket, outbox: asyncio.Queue):
+        while True:
+            batch = [await outbox.get()]
+            while len(batch) < WS_BATCH_SIZE and not outbox.empty():
+                batch.append(outbox.get_nowait())
+            frame = batch[0] if len(batch) == 1 else b"[" + b",".join(batch) + b"]"
+            try:
+                await websocket.send_bytes(frame)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # The endpoint's receive loop notices the closed socket and disconnects it
+                return
+
+    def _timestamp(self) -> bytes:
+        second = int(time.time())
+        if second != self._timestamp_second:
+            self._timestamp_second = second
+            self._timestamp_json = orjson.dumps(datetime.fromtimestamp(second, timezone.utc))
+        return self._timestamp_json
+
+    def _nobody_listening(self, device_id: int) -> bool:
+        """
+        True when no socket can receive updates for the device. Only knowable
+        in-process: with Redis Pub/Sub, sockets on other workers may be subscribed.
+        """
+        if redis_pubsub.enabled:
+            return False
+        channel, _ = _position_update_envelope(device_id)
+        return channel not in self.channel_subscribers
+
     async def broadcast_position_update(self, position: NormalizedPosition, device: Device):
-        state_data = {}
-        if device.state:
-            state_data = {
-                "total_odometer": device.state.total_odometer,
-                "trip_odometer": device.state.trip_odometer,
-                "is_moving": device.state.is_moving,
-                "is_online": device.state.is_online,
-            }
-        message = {
-            "type": WSMessageType.POSITION_UPDATE.value,
-            "device_id": device.id,
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "data": {
-                "last_latitude": position.latitude,
-                "last_longitude": position.longitude,
-                "last_altitude": position.altitude,
-                "satellites": position.satellites,
-                "last_speed": position.speed,
-                "last_course": position.course,
-                "ignition_on": position.ignition if position.ignition is not None else False,
-                "last_update": position.device_time.isoformat(),
-                **state_data,
-            },
-        }
-        await redis_pubsub.publish(f"device:{device.id}", message)
+        if self._nobody_listening(device.id):
+            return
+        # Only the per-fix data is encoded; the envelope prefix is cached per device
+        fix = (
+            position.latitude,
+            position.longitude,
+            position.altitude,
+            position.satellites,
+            position.speed,
+            position.course,
+            position.ignition if position.ignition is not None else False,
+            position.device_time,
+        )
+        state = device.state
+        if state:
+            data = _PositionFixWithState(
+                *fix, state.total_odometer, state.trip_odometer, state.is_moving, state.is_online
+            )
+        else:
+            data = _PositionFix(*fix)
+        channel, prefix = _position_update_envelope(device.id)
+        await redis_pubsub.publish_raw(
+            channel,
+            b"".join((prefix, orjson.dumps(data), b',"timestamp":', self._timestamp(), b"}")),
+        )
 
     async def broadcast_alert(self, alert: AlertHistory):
+        if self._nobody_listening(alert.device_id):
+            return
         message = {
             "type": WSMessageType.ALERT.value,
             "device_id": alert.device_id,
-            "timestamp": alert.created_at.isoformat(),
-            "data": {
-                "id": alert.id,
-                "type": alert.alert_type,
-                "severity": alert.severity,
-                "message": alert.message,
-                "alert_metadata": alert.alert_metadata,
-                "created_at": alert.created_at.isoformat(),
-            },
+            "timestamp": alert.created_at,
+            "data": _AlertData(
+                alert.id,
+                alert.alert_type,
+                alert.severity,
+                alert.message,
+                alert.alert_metadata,
+                alert.created_at,
+            ),
         }
         await redis_pubsub.publish(f"device:{alert.device_id}", message)
 
 
 ws_manager = WebSocketManager()
 
+# Bound once in lifespan; the TCP/UDP callbacks read these directly
+db_service: Optional[DatabaseService] = None
+alert_engine = None
+
 
 # ==================== Position / Command Callbacks ====================
 
 async def process_position_callback(position: NormalizedPosition):
     try:
-        db = get_db()
+        db = db_service
         success = await db.process_position(position)
         if not success:
             return
         device = await db.get_device_by_imei(position.imei)
         if not device or not device.state:
             return
-        alert_engine = get_alert_engine()
+        # Trips and statistics may have changed
+        invalidate_device(device.id)
         await alert_engine.process_position_alerts(position, device, device.state)
         await ws_manager.broadcast_position_update(position, device)
         logger.debug(f"Position processed: {device.name}")
-    except Exception as e:
-        logger.error(f"Position processing error: {e}", exc_info=True)                    
     except Exception as e:
         logger.error(f"Position processing error: {e}", exc_info=True)
 
 
+position_queues: List[asyncio.Queue] = [asyncio.Queue(maxsize=POSITION_QUEUE_SIZE) for _ in range(POSITION_WORKERS)]
+position_workers: List[asyncio.Task] = []
+# Cleared at shutdown so the queues can drain
+accepting_positions = True
+
+
+async def enqueue_position(position: NormalizedPosition):
+    """
+    Position callback for the TCP/UDP servers: hands the fix to its device's
+    worker so the connection can go on reading and ACKing without waiting
+    for the database, alerts and broadcast.
+    """
+    if not accepting_positions:
+        # Raising drops the connection before its pending ACKs are written,
+        # so the device keeps the fix and resends it after the restart
+        raise ConnectionAbortedError("shutting down, not accepting positions")
+    queue = position_queues[hash(position.imei) % POSITION_WORKERS]
+    try:
+        queue.put_nowait(position)
+    except asyncio.QueueFull:
+        # Pipeline is behind; hold this connection until there is room
+        await queue.put(position)
+
+
+async def position_worker(queue: asyncio.Queue):
+    while True:
+        position = await queue.get()
+        try:
+            await process_position_callback(position)
+        except Exception as e:
+            # Never let one fix take down the worker that owns its devices
+            logger.error(f"Position worker error: {e}", exc_info=True)
+        finally:
+            queue.task_done()
+
+
+async def drain_position_queues():
+    """Stop taking fixes, let the workers finish the ones already queued, then stop them."""
+    global accepting_positions
+    accepting_positions = False
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(*(queue.join() for queue in position_queues)), POSITION_DRAIN_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        pending = sum(queue.qsize() for queue in position_queues)
+        logger.error(f"Position queues not drained in {POSITION_DRAIN_TIMEOUT}s, dropping {pending} fixes")
+    for task in position_workers:
+        task.cancel()
+    await asyncio.gather(*position_workers, return_exceptions=True)
+    position_workers.clear()
+
+
 async def command_callback(imei: str, writer):
     try:
-        db = get_db()
-        device = await db.get_device_by_imei(imei)
+        db = db_service
+        device = await db.get_device_ref_by_imei(imei)
         if not device:
             return
         commands = await db.get_pending_commands(device.id)
+        decoder = ProtocolRegistry.get_decoder(device.protocol)
+        if not commands or not decoder:
+            return
+        # All pending commands go out in one write and are marked sent in one UPDATE
+        batch = []
+        sent = []
         for command in commands:
-            decoder = ProtocolRegistry.get_decoder(device.protocol)
-            if not decoder:
-                continue
             command_bytes = await decoder.encode_command(
                 command.command_type, {"payload": command.payload}
             )
             if command_bytes:
-                writer.write(command_bytes)
-                await writer.drain()
-                await db.mark_command_sent(command.id)
-                logger.info(f"Command sent to {device.name}: {command.command_type}")
+                batch.append(command_bytes)
+                sent.append(command)
+        if not batch or not await write_command(imei, writer, b"".join(batch)):
+            return
+        await db.mark_commands_sent([command.id for command in sent])
+        for command in sent:
+            logger.info(f"Command sent to {device.name}: {command.command_type}")
     except Exception as e:
         logger.error(f"Command callback error: {e}", exc_info=True)
 
@@ -183,14 +471,15 @@ async def handle_new_alert(alert: AlertHistory):
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global db_service, alert_engine
     logger.info("Starting Routario Platform...")
     settings = get_settings()
 
-    await init_database(settings.database_url)
+    db = db_service = await init_database(settings.database_url)
+    app.state.db = db
 
     # Create default admin on first run
     if settings.admin_password:
-        db = get_db()
         try:
             existing = await db.get_user_by_username(settings.admin_username)
             if not existing:
@@ -209,33 +498,47 @@ async def lifespan(app: FastAPI):
 
 
     redis_pubsub.redis_url = settings.redis_url
+    redis_pubsub.enabled = settings.redis_pubsub_enabled
     await redis_pubsub.connect()
 
     alert_engine = get_alert_engine()
     alert_engine.set_alert_callback(handle_new_alert)
 
+    position_workers[:] = [asyncio.create_task(position_worker(queue)) for queue in position_queues]
+
+    server_tasks: List[asyncio.Task] = []
     protocols = ProtocolRegistry.get_all()
     for name, decoder in protocols.items():
         port = decoder.PORT
         for protocol_type in decoder.PROTOCOL_TYPES:
             if protocol_type == "udp":
-                server = UDPServer(settings.udp_host, port, name, process_position_callback)
-                asyncio.create_task(server.start())
+                server = UDPServer(settings.udp_host, port, name, enqueue_position)
+                server_tasks.append(asyncio.create_task(server.start()))
                 logger.info(f"Started UDP Server for {name} on port {port}")
             else:
-                server = TCPServer(settings.tcp_host, port, name, process_position_callback, command_callback)
-                asyncio.create_task(server.start())
+                server = TCPServer(settings.tcp_host, port, name, enqueue_position, command_callback)
+                server_tasks.append(asyncio.create_task(server.start()))
                 logger.info(f"Started TCP Server for {name} on port {port}")
 
+    if redis_pubsub.enabled:
+        asyncio.create_task(ws_manager.listen_to_redis())
+    else:
+        asyncio.create_task(ws_manager.relay_local())
     asyncio.create_task(periodic_alert_task())
+    asyncio.create_task(connection_summary_task())
     logger.info("Routario Platform started successfully")
 
     yield
 
     logger.info("Shutting down Routario Platform...")
-    db = get_db()
-    await db.close()
+    # Stop listening for devices, then finish the fixes they were already ACKed for
+    for task in server_tasks:
+        task.cancel()
+    await asyncio.gather(*server_tasks, return_exceptions=True)
+    await drain_position_queues()
+    await app.state.db.close()
     await redis_pubsub.close()
+    await get_push_service().close()
     logger.info("Routario Platform shutdown complete")
 
 
@@ -290,50 +593,26 @@ async def settings_page():
 @app.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: int):
     await ws_manager.connect(user_id, websocket)
-    r = await redis.from_url(get_settings().redis_url, decode_responses=True)
-    pubsub = r.pubsub()
+    device_channels: List[str] = []
     try:
         db = get_db()
-        devices = await db.get_user_devices(user_id)
-        device_channels = [f"device:{device.id}" for device in devices]
-        if device_channels:
-            await pubsub.subscribe(*device_channels)
-
-        async def listen_to_redis():
-            try:
-                async for message in pubsub.listen():
-                    if message["type"] == "message":
-                        try:
-                            await websocket.send_text(message["data"])
-                        except Exception as e:
-                            logger.error(f"WS Send Error: {e}")
-                            break
-            except asyncio.CancelledError:
-                pass  # Graceful shutdown, nothing to do
-            finally:
-                await pubsub.unsubscribe()
-                await pubsub.aclose()
-
-        async def listen_to_client():
-            try:
-                while True:
-                    await websocket.receive_text()
-            except WebSocketDisconnect:
-                pass
+        device_channels = [f"device:{device_id}" for device_id in await db.get_user_device_ids(user_id)]
+        # Messages arrive through ws_manager's shared Redis listener
+        await ws_manager.subscribe(websocket, device_channels)
 
         try:
-            await asyncio.gather(listen_to_redis(), listen_to_client())
-        except asyncio.CancelledError:
-                pass
-        finally:
-            # any websocket cleanup here
-            logger.info(f"WebSocket disconnected for user {user_id}")
+            while True:
+                await websocket.receive_text()
+        except (WebSocketDisconnect, asyncio.CancelledError):
+            pass
 
     except Exception as e:
         logger.error(f"WebSocket Error: {e}")
     finally:
-        await pubsub.aclose()
-        await r.aclose()
+        try:
+            await ws_manager.unsubscribe(websocket, device_channels)
+        except Exception as e:
+            logger.error(f"WebSocket unsubscribe error: {e}")
         ws_manager.disconnect(user_id, websocket)
 
 
@@ -346,7 +625,12 @@ def run_server():
         app,
         host="0.0.0.0",
         port=8000,
-        loop="uvloop",
+        # The TCP/UDP gateways share this loop; uvloop has no Windows build
+        loop="uvloop" if sys.platform != "win32" else "asyncio",
+        # C parser from uvicorn[standard]. The app stays single-process: the
+        # device gateways, connection_manager and background tasks live in it
+        http="httptools",
+        ws="websockets",
         timeout_graceful_shutdown=2,
     ))
 
@@ -42,8 +42,6 @@ class CommandStatus(str, Enum):
 
 class NormalizedPosition(BaseModel):
     """Standardized GPS position from any protocol"""
-    model_config = ConfigDict(arbitrary_types_allowed=True)
-    
     imei: str
     device_time: datetime
     
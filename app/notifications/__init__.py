@@ -2,10 +2,11 @@
 Notifications Package
 Automatically discovers and registers all notification channel modules.
 
-Channel modules are tried in registration order (alphabetical file name).
-The first channel whose matches() returns True handles the URL.
-The apprise channel is intentionally named to sort last so custom schemes
-take priority over Apprise's broad catch-all.
+Channels that declare SCHEMES are found by a dict lookup on the URL scheme.
+Only when no scheme matches are the remaining catch-all channels tried in
+registration order (alphabetical file name); the first whose matches()
+returns True handles the URL. The apprise channel is intentionally named to
+sort last so any other catch-all takes priority over it.
 """
 
 import importlib
@@ -14,13 +15,15 @@ import logging
 import pkgutil
 from pathlib import Path
 
-from .base import BaseNotificationChannel
+from .base import BaseNotificationChannel, url_scheme
 
 logger = logging.getLogger(__name__)
 
 # Ordered list of registered channel classes.
 # Channels are tried in this order; first match wins.
 CHANNEL_REGISTRY: list[type[BaseNotificationChannel]] = []
+# scheme -> owning channel; the first registered channel claiming a scheme keeps it
+_SCHEME_MAP: dict[str, type[BaseNotificationChannel]] = {}
 
 for _, module_name, _ in pkgutil.iter_modules([str(Path(__file__).parent)]):
     if module_name == "base":
@@ -30,6 +33,8 @@ for _, module_name, _ in pkgutil.iter_modules([str(Path(__file__).parent)]):
         for _name, obj in inspect.getmembers(module, inspect.isclass):
             if issubclass(obj, BaseNotificationChannel) and obj is not BaseNotificationChannel:
                 CHANNEL_REGISTRY.append(obj)
+                for scheme in obj.SCHEMES:
+                    _SCHEME_MAP.setdefault(scheme.lower(), obj)
                 logger.debug(f"Registered notification channel: {obj.__name__}")
     except Exception as e:
         logger.error(f"Failed to load notification module '{module_name}': {e}")
@@ -37,10 +42,26 @@ for _, module_name, _ in pkgutil.iter_modules([str(Path(__file__).parent)]):
 if not CHANNEL_REGISTRY:
     logger.error("No notification channels registered — check the notifications/ package.")
 
+# Channels without SCHEMES, asked in registration order when the lookup misses
+_CATCH_ALL_CHANNELS = [cls for cls in CHANNEL_REGISTRY if not cls.SCHEMES]
+
+# One shared instance per channel class, created on first use
+_INSTANCES: dict[type[BaseNotificationChannel], BaseNotificationChannel] = {}
+
+
+def _instance(channel_cls: type[BaseNotificationChannel]) -> BaseNotificationChannel:
+    channel = _INSTANCES.get(channel_cls)
+    if channel is None:
+        channel = _INSTANCES[channel_cls] = channel_cls()
+    return channel
+
 
 def get_channel(url: str) -> BaseNotificationChannel | None:
-    """Return the first registered channel that matches the URL, or None."""
-    for channel_cls in CHANNEL_REGISTRY:
+    """Return the channel owning the URL's scheme, else the first matching catch-all, or None."""
+    channel_cls = _SCHEME_MAP.get(url_scheme(url))
+    if channel_cls is not None:
+        return _instance(channel_cls)
+    for channel_cls in _CATCH_ALL_CHANNELS:
         if channel_cls.matches(url):
-            return channel_cls()
+            return _instance(channel_cls)
     return None
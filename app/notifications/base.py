@@ -5,15 +5,17 @@ All notification channels must subclass BaseNotificationChannel.
 To add a new channel type:
   1. Create a new .py file in this folder (e.g. my_channel.py).
   2. Define a class that subclasses BaseNotificationChannel.
-  3. Implement matches() and send().
+  3. List the URL schemes it owns in SCHEMES and implement send().
+     Catch-all channels leave SCHEMES empty and override matches() instead.
   4. That's it — it will be picked up automatically on next startup.
 
+The registry creates one instance per channel class and shares it across
+all alerts, so send() may run concurrently on the same instance: keep
+per-call data in locals, and anything on self (clients, pools) safe to share.
+
 Example:
     class MyChannel(BaseNotificationChannel):
-
-        @classmethod
-        def matches(cls, url: str) -> bool:
-            return url.startswith("myscheme://")
+        SCHEMES = ("myscheme",)
 
         async def send(self, url: str, title: str, message: str) -> bool:
             ...
@@ -21,19 +23,28 @@ Example:
 """
 
 from abc import ABC, abstractmethod
+from typing import ClassVar
+
+
+def url_scheme(url: str) -> str:
+    """Lower-cased scheme of a channel URL ("" when it has none)."""
+    scheme, sep, _ = url.strip().partition("://")
+    return scheme.lower() if sep else ""
 
 
 class BaseNotificationChannel(ABC):
 
+    # URL schemes this channel owns (without "://"); the registry dispatches on them directly
+    SCHEMES: ClassVar[tuple[str, ...]] = ()
+
     @classmethod
-    @abstractmethod
     def matches(cls, url: str) -> bool:
         """
         Return True if this channel handles the given URL.
-        Called once per URL to decide which channel class owns it.
-        The registry tries channels in registration order; the first match wins.
+        Only consulted for channels without SCHEMES, after the scheme lookup
+        missed; those are tried in registration order and the first match wins.
         """
-        ...
+        return url_scheme(url) in cls.SCHEMES
 
     @abstractmethod
     async def send(self, url: str, title: str, message: str) -> bool:
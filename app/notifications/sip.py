@@ -39,10 +39,7 @@ logger = logging.getLogger(__name__)
 
 
 class SipChannel(BaseNotificationChannel):
-
-    @classmethod
-    def matches(cls, url: str) -> bool:
-        return url.strip().lower().startswith("sip://")
+    SCHEMES = ("sip",)
 
     async def send(self, url: str, title: str, message: str) -> bool:
         params = self._parse_url(url)
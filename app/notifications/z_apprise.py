@@ -12,7 +12,7 @@ import logging
 
 from apprise import Apprise
 
-from .base import BaseNotificationChannel
+from .base import BaseNotificationChannel, url_scheme
 
 logger = logging.getLogger(__name__)
 
@@ -21,9 +21,10 @@ class AppriseChannel(BaseNotificationChannel):
 
     @classmethod
     def matches(cls, url: str) -> bool:
-        # Apprise is the catch-all — it accepts everything except sip://
-        # which is handled by SipChannel earlier in the registry.
-        return not url.strip().lower().startswith("sip://")
+        # Apprise is the catch-all — it is only asked about URLs whose scheme
+        # no channel claimed. sip:// stays refused even when SipChannel failed
+        # to load, rather than being handed to Apprise.
+        return url_scheme(url) != "sip"
 
     async def send(self, url: str, title: str, message: str) -> bool:
         try:
@@ -25,8 +25,28 @@ class BaseProtocolDecoder(ABC):
         """
         Decode raw bytes into normalized position
         Returns: (Result, ConsumedBytes)
+
+        Over TCP, data is the connection's live receive buffer (a bytearray) and
+        may hold several frames. Don't keep references to it after returning.
+        Binary decoders should read fields in place with struct.Struct.unpack_from
+        at an offset rather than unpacking slices.
         """
         pass
+
+    def decode_sync(self, data: bytes, client_info: Dict[str, Any], known_imei: Optional[str] = None) -> Optional[Tuple[Union[NormalizedPosition, Dict[str, Any], None], int]]:
+        """
+        Run decode() to completion without scheduling it on the event loop.
+        Decoders only parse bytes, so the coroutine normally finishes on its
+        first step. Returns None if it tries to wait on something; the caller
+        should then await decode() instead.
+        """
+        coro = self.decode(data, client_info, known_imei)
+        try:
+            coro.send(None)
+        except StopIteration as done:
+            return done.value
+        coro.close()
+        return None
     
     @abstractmethod
     async def encode_command(self, command_type: str, params: Dict[str, Any]) -> bytes:
@@ -36,6 +56,8 @@ class BaseProtocolDecoder(ABC):
 class ProtocolRegistry:
     """Registry for GPS protocol decoders"""
     _decoders: Dict[str, BaseProtocolDecoder] = {}
+    # protocol -> command-support summary; decoders' command sets are fixed at runtime
+    _command_support: Dict[str, Dict[str, Any]] = {}
     
     @classmethod
     def register(cls, protocol_name: str):
@@ -62,6 +84,48 @@ class ProtocolRegistry:
     def get_all(cls) -> Dict[str, BaseProtocolDecoder]:
         return cls._decoders
 
+    @classmethod
+    async def get_command_support(cls, protocol_name: str) -> Dict[str, Any]:
+        """Commands a protocol can send, with their descriptions. Built once per protocol."""
+        key = protocol_name.lower()
+        support = cls._command_support.get(key)
+        if support is None:
+            support = cls._command_support[key] = await cls._build_command_support(protocol_name)
+        return support
+
+    @classmethod
+    async def _build_command_support(cls, protocol_name: str) -> Dict[str, Any]:
+        decoder = cls.get_decoder(protocol_name)
+        if not decoder:
+            return {"supports_commands": False, "available_commands": [], "protocol": protocol_name, "command_info": {}}
+
+        available_commands = []
+        command_info = {}
+        if hasattr(decoder, "get_available_commands"):
+            try:
+                available_commands = decoder.get_available_commands()
+                if hasattr(decoder, "get_command_info"):
+                    for cmd in available_commands:
+                        command_info[cmd] = decoder.get_command_info(cmd)
+            except Exception:
+                pass
+        else:
+            # No declared command list: probe the common command types
+            for cmd_type in ["reset", "interval", "reboot", "custom"]:
+                try:
+                    result = await decoder.encode_command(cmd_type, {})
+                    if result and len(result) > 0:
+                        available_commands.append(cmd_type)
+                except Exception:
+                    pass
+
+        return {
+            "supports_commands": len(available_commands) > 0,
+            "available_commands": available_commands,
+            "protocol": protocol_name,
+            "command_info": command_info,
+        }
+
 # ==================== Automatic Protocol Discovery ====================
 
 def load_protocols():
@@ -3,7 +3,7 @@ Flespi Protocol Decoder
 Supports Flespi's standardized message format for GPS tracking devices
 """
 import struct
-import json
+import orjson
 from datetime import datetime, timezone
 from typing import Dict, Any, Optional, Tuple, Union
 import logging
@@ -73,15 +73,9 @@ class FlespiDecoder(BaseProtocolDecoder):
             if not data or len(data) == 0:
                 return None, 0
             
-            # Try to decode as UTF-8
-            try:
-                text = data.decode('utf-8')
-            except UnicodeDecodeError:
-                logger.error("Flespi: Failed to decode UTF-8")
-                return None, 1  # Skip one byte and try again
-            
-            # Find the first newline (message delimiter)
-            newline_idx = text.find('\n')
+            # Find the first newline (message delimiter); orjson parses the
+            # bytes directly, so the buffer is never decoded to str
+            newline_idx = data.find(b'\n')
             if newline_idx == -1:
                 # No complete message yet, need more data
                 if len(data) > 8192:  # Prevent buffer overflow
@@ -90,16 +84,16 @@ class FlespiDecoder(BaseProtocolDecoder):
                 return None, 0
             
             # Extract the complete JSON message
-            json_str = text[:newline_idx].strip()
-            consumed = len(json_str.encode('utf-8')) + 1  # +1 for newline
+            json_bytes = bytes(data[:newline_idx]).strip()
+            consumed = newline_idx + 1  # +1 for newline
             
-            if not json_str:
+            if not json_bytes:
                 return None, consumed
             
-            # Parse JSON
+            # Parse JSON (invalid UTF-8 is reported as a decode error too)
             try:
-                message = json.loads(json_str)
-            except json.JSONDecodeError as e:
+                message = orjson.loads(json_bytes)
+            except orjson.JSONDecodeError as e:
                 logger.error(f"Flespi: JSON decode error: {e}")
                 return None, consumed
             
@@ -314,15 +308,14 @@ class FlespiDecoder(BaseProtocolDecoder):
                 payload = params.get('payload', {})
                 if isinstance(payload, str):
                     try:
-                        payload = json.loads(payload)
-                    except json.JSONDecodeError:
+                        payload = orjson.loads(payload)
+                    except orjson.JSONDecodeError:
                         payload = {"data": payload}
                 
                 command_msg.update(payload)
             
             # Encode as JSON with newline delimiter
-            json_str = json.dumps(command_msg) + "\n"
-            return json_str.encode('utf-8')
+            return orjson.dumps(command_msg) + b"\n"
             
         except Exception as e:
             logger.error(f"Flespi command encode error: {e}")
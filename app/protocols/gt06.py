@@ -1,3 +1,4 @@
+import binascii
 import struct
 from datetime import datetime, timezone
 from typing import Dict, Any, Optional, Tuple, Union
@@ -7,6 +8,10 @@ from . import BaseProtocolDecoder, ProtocolRegistry
 
 logger = logging.getLogger(__name__)
 
+# Big-endian field layouts, read in place with unpack_from
+_U16 = struct.Struct('>H')
+_U32 = struct.Struct('>I')
+
 @ProtocolRegistry.register("gt06")
 class GT06Decoder(BaseProtocolDecoder):
     PORT = 5023
@@ -31,37 +36,36 @@ class GT06Decoder(BaseProtocolDecoder):
             else:
                 if len(data) < 6:
                     return None, 0
-                content_len = struct.unpack('>H', data[2:4])[0]
+                content_len = _U16.unpack_from(data, 2)[0]
                 total_len = content_len + 6
 
             if len(data) < total_len:
                 return None, 0
 
-            packet = data[:total_len]
             consumed = total_len
             offset = 3 if start_bit == b'\x78\x78' else 4
-            protocol_number = packet[offset]
+            protocol_number = data[offset]
 
             # Login packet
             if protocol_number == 0x01:
-                imei = self._parse_imei(packet[offset + 1:offset + 9])
-                serial = packet[offset + 9:offset + 11]
+                imei = self._parse_imei(data[offset + 1:offset + 9])
+                serial = data[offset + 9:offset + 11]
                 resp = b'\x78\x78\x05\x01' + serial
                 crc = self._crc_16(resp[2:])
-                resp += struct.pack('>H', crc) + b'\x0D\x0A'
+                resp += _U16.pack(crc) + b'\x0D\x0A'
                 return {"event": "login", "imei": imei, "response": resp}, consumed
 
             # GPS position packets
             if protocol_number in [0x12, 0x16, 0x1A]:
-                pos = self._parse_position(packet, offset, known_imei)
+                pos = self._parse_position(data, offset, known_imei)
                 return pos, consumed
 
             # Heartbeat
             if protocol_number == 0x13:
-                serial = packet[offset + 1:offset + 3]
+                serial = data[offset + 1:offset + 3]
                 resp = b'\x78\x78\x05\x13' + serial
                 crc = self._crc_16(resp[2:])
-                resp += struct.pack('>H', crc) + b'\x0D\x0A'
+                resp += _U16.pack(crc) + b'\x0D\x0A'
                 return {"event": "heartbeat", "response": resp}, consumed
 
             return None, consumed
@@ -103,16 +107,16 @@ class GT06Decoder(BaseProtocolDecoder):
             # bit  13     = GPS real-time        (1=real-time)
             # bit  14     = ACC / ignition       (1=on)
             # bit  15     = reserved
-            course_status = struct.unpack('>H', data[gps_offset + 1:gps_offset + 3])[0]
+            course_status = _U16.unpack_from(data, gps_offset + 1)[0]
             course    = float(course_status & 0x03FF)
             lat_south = bool(course_status & 0x0400)   # FIX: apply hemisphere
             lon_west  = bool(course_status & 0x0800)   # FIX: apply hemisphere
             gps_valid = bool(course_status & 0x1000)   # FIX: use real validity bit
             ignition  = bool(course_status & 0x4000)
 
-            lat_raw   = struct.unpack('>I', data[gps_offset + 3:gps_offset + 7])[0]
+            lat_raw   = _U32.unpack_from(data, gps_offset + 3)[0]
             latitude  = lat_raw / 1_800_000.0
-            lon_raw   = struct.unpack('>I', data[gps_offset + 7:gps_offset + 11])[0]
+            lon_raw   = _U32.unpack_from(data, gps_offset + 7)[0]
             longitude = lon_raw / 1_800_000.0
 
             # FIX: apply hemisphere signs
@@ -152,22 +156,14 @@ class GT06Decoder(BaseProtocolDecoder):
         return str(int(imei_bytes.hex(), 16))
 
     def _crc_16(self, data: bytes) -> int:
-        crc = 0xFFFF
-        for byte in data:
-            crc ^= (byte << 8)
-            for _ in range(8):
-                if crc & 0x8000:
-                    crc = (crc << 1) ^ 0x1021
-                else:
-                    crc <<= 1
-            crc &= 0xFFFF
-        return crc
+        # CRC-16/CCITT (poly 0x1021, init 0xFFFF), computed in C
+        return binascii.crc_hqx(data, 0xFFFF)
 
     async def encode_command(self, command_type: str, params: Dict[str, Any]) -> bytes:
         if command_type == "reset":
             cmd = b'\x78\x78\x05\x80\x01\x00\x01'
             crc = self._crc_16(cmd[2:])
-            return cmd + struct.pack('>H', crc) + b'\x0D\x0A'
+            return cmd + _U16.pack(crc) + b'\x0D\x0A'
         return b''
 
     def get_available_commands(self) -> list:
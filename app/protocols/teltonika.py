@@ -8,6 +8,27 @@ from . import BaseProtocolDecoder, ProtocolRegistry
 
 logger = logging.getLogger(__name__)
 
+# Big-endian field layouts, read in place with unpack_from
+_U16 = struct.Struct('>H')
+_U32 = struct.Struct('>I')
+_U64 = struct.Struct('>Q')
+
+
+def _crc16_table() -> Tuple[int, ...]:
+    table = []
+    for n in range(256):
+        crc = n
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if (crc & 1) else (crc >> 1)
+        table.append(crc)
+    return tuple(table)
+
+
+# CRC-16/IBM (reflected poly 0xA001), one lookup per byte
+_CRC16_TABLE = _crc16_table()
+# GPS element: longitude, latitude, altitude, angle, satellites, speed
+_GPS_ELEMENT = struct.Struct('>iihHBH')
+
 
 @ProtocolRegistry.register("teltonika")
 class TeltonikaDecoder(BaseProtocolDecoder):
@@ -191,26 +212,26 @@ class TeltonikaDecoder(BaseProtocolDecoder):
             # ---- TCP data packet ----------------------------------------
             # Header: 4 zero bytes | 4-byte data-field length | payload | 4-byte CRC
             if len(data) >= 8 and data[0:4] == b'\x00\x00\x00\x00':
-                data_length = struct.unpack('>I', data[4:8])[0]
+                data_length = _U32.unpack_from(data, 4)[0]
                 total_len   = 8 + data_length + 4
                 if len(data) < total_len:
                     return None, 0          # wait for more bytes
 
-                packet_data = data[8:8 + data_length]
-                consumed    = total_len
+                consumed = total_len
 
-                if len(packet_data) < 2:
+                if data_length < 2:
                     return None, consumed
 
-                codec_id     = packet_data[0]
-                record_count = packet_data[1]
+                codec_id     = data[8]
+                record_count = data[9]
 
                 if codec_id in (0x08, 0x8E):
                     extended  = (codec_id == 0x8E)
+                    # Records are parsed in place between offsets 10 and the end of the data field
                     positions = self._decode_all_records(
-                        packet_data[2:], known_imei, extended
+                        data, 10, 8 + data_length, known_imei, extended
                     )
-                    ack = struct.pack('>I', record_count)
+                    ack = _U32.pack(record_count)
 
                     if positions:
                         return {
@@ -227,7 +248,7 @@ class TeltonikaDecoder(BaseProtocolDecoder):
 
             # ---- IMEI login packet --------------------------------------
             elif len(data) >= 2:
-                imei_len = struct.unpack('>H', data[0:2])[0]
+                imei_len = _U16.unpack_from(data)[0]
                 if imei_len == 0:
                     return None, 1 if len(data) >= 4 else 0
                 if len(data) >= imei_len + 2:
@@ -299,11 +320,12 @@ class TeltonikaDecoder(BaseProtocolDecoder):
         self,
         data:       bytes,
         offset:     int,
+        end:        int,
         known_imei: str,
         extended:   bool,
     ) -> Tuple[Optional[NormalizedPosition], int]:
         """
-        Parse one AVL record starting at *offset*.
+        Parse one AVL record starting at *offset*, reading no further than *end*.
         Returns (NormalizedPosition | None, bytes_consumed).
 
         AVL record layout
@@ -330,28 +352,25 @@ class TeltonikaDecoder(BaseProtocolDecoder):
         start = offset
 
         # --- Timestamp ---------------------------------------------------
-        if offset + 8 > len(data):
+        if offset + 8 > end:
             return None, 0
-        timestamp_ms = struct.unpack('>Q', data[offset:offset + 8])[0]
+        timestamp_ms = _U64.unpack_from(data, offset)[0]
         device_time  = datetime.fromtimestamp(timestamp_ms / 1000.0, tz=timezone.utc)
         offset += 8
 
         # --- Priority ----------------------------------------------------
-        if offset + 1 > len(data):
+        if offset + 1 > end:
             return None, 0
         priority = data[offset]
         offset += 1
 
         # --- GPS element (15 bytes) --------------------------------------
-        if offset + 15 > len(data):
+        if offset + 15 > end:
             return None, 0
 
-        lon   = struct.unpack('>i', data[offset:offset + 4])[0] / 10_000_000.0
-        lat   = struct.unpack('>i', data[offset + 4:offset + 8])[0] / 10_000_000.0
-        alt   = struct.unpack('>h', data[offset + 8:offset + 10])[0]
-        angle = struct.unpack('>H', data[offset + 10:offset + 12])[0]
-        sats  = data[offset + 12]
-        speed = struct.unpack('>H', data[offset + 13:offset + 15])[0]
+        lon, lat, alt, angle, sats, speed = _GPS_ELEMENT.unpack_from(data, offset)
+        lon /= 10_000_000.0
+        lat /= 10_000_000.0
         offset += 15
 
         # Discard records with no GPS fix (device reports 0,0 when invalid)
@@ -361,7 +380,7 @@ class TeltonikaDecoder(BaseProtocolDecoder):
         # Codec 8:   event_io_id (1B) + total_io_count (1B) = 2 bytes
         # Codec 8E:  event_io_id (2B) + total_io_count (2B) = 4 bytes
         header_size = 4 if extended else 2
-        if offset + header_size > len(data):
+        if offset + header_size > end:
             return None, 0
         # We don't use the event_io_id or total_io_count values, just skip them.
         offset += header_size
@@ -375,10 +394,10 @@ class TeltonikaDecoder(BaseProtocolDecoder):
 
         def read_count() -> int:
             nonlocal offset
-            if offset + count_width > len(data):
+            if offset + count_width > end:
                 return 0
             if extended:
-                val = struct.unpack('>H', data[offset:offset + 2])[0]
+                val = _U16.unpack_from(data, offset)[0]
             else:
                 val = data[offset]
             offset += count_width
@@ -387,20 +406,20 @@ class TeltonikaDecoder(BaseProtocolDecoder):
         def read_id() -> int:
             nonlocal offset
             if extended:
-                val = struct.unpack('>H', data[offset:offset + 2])[0]
+                val = _U16.unpack_from(data, offset)[0]
             else:
                 val = data[offset]
             offset += id_width
             return val
 
-        def parse_io_group(byte_width: int, unpack_fn) -> None:
+        def parse_io_group(byte_width: int, field: Optional[struct.Struct]) -> None:
             nonlocal offset, ignition
             count = read_count()
             for _ in range(count):
-                if offset + id_width + byte_width > len(data):
+                if offset + id_width + byte_width > end:
                     break
                 io_id = read_id()
-                raw   = unpack_fn(data[offset:offset + byte_width])
+                raw   = field.unpack_from(data, offset)[0] if field else data[offset]
                 offset += byte_width
 
                 # Ignition is a special top-level field
@@ -416,10 +435,10 @@ class TeltonikaDecoder(BaseProtocolDecoder):
                 key = self.IO_MAP.get(io_id, f'io_{io_id}')
                 sensors[key] = val
 
-        parse_io_group(1, lambda b: b[0])
-        parse_io_group(2, lambda b: struct.unpack('>H', b)[0])
-        parse_io_group(4, lambda b: struct.unpack('>I', b)[0])
-        parse_io_group(8, lambda b: struct.unpack('>Q', b)[0])
+        parse_io_group(1, None)
+        parse_io_group(2, _U16)
+        parse_io_group(4, _U32)
+        parse_io_group(8, _U64)
 
         # Build position — return None if no valid GPS fix but still consume bytes
         consumed = offset - start
@@ -454,19 +473,20 @@ class TeltonikaDecoder(BaseProtocolDecoder):
     def _decode_all_records(
         self,
         data:       bytes,
+        offset:     int,
+        end:        int,
         known_imei: Optional[str],
         extended:   bool,
     ) -> List[NormalizedPosition]:
-        """Decode every AVL record; skip records with no GPS fix."""
+        """Decode every AVL record in data[offset:end]; skip records with no GPS fix."""
         if not known_imei:
             return []
 
         positions: List[NormalizedPosition] = []
-        offset = 0
 
-        while offset < len(data):
+        while offset < end:
             try:
-                pos, consumed = self._decode_single_record(data, offset, known_imei, extended)
+                pos, consumed = self._decode_single_record(data, offset, end, known_imei, extended)
                 if consumed == 0:
                     break                        # nothing parsed, stop
                 offset += consumed
@@ -515,8 +535,7 @@ class TeltonikaDecoder(BaseProtocolDecoder):
     @staticmethod
     def _crc16(data: bytes) -> int:
         crc = 0
+        table = _CRC16_TABLE
         for byte in data:
-            crc ^= byte
-            for _ in range(8):
-                crc = (crc >> 1) ^ 0xA001 if (crc & 1) else (crc >> 1)
-        return crc & 0xFFFF
+            crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+        return crc
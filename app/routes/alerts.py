@@ -14,12 +14,15 @@ from fastapi import APIRouter, HTTPException, Query, Depends
 
 from core.database import get_db
 from core.auth import get_current_user
+from core.resp_cache import rows_to_json
 from models import User
 from models.schemas import AlertResponse
 from alerts import ALERT_DEFINITIONS_PUBLIC
 
 router = APIRouter(prefix="/api/alerts", tags=["alerts"])
 
+ALERT_FIELDS = tuple(AlertResponse.model_fields)
+
 
 @router.get("/types")
 async def get_alert_types(current_user: User = Depends(get_current_user)):
@@ -58,8 +61,8 @@ async def get_alerts(
     """Return alerts for the authenticated user only."""
     db = get_db()
     if unread_only:
-        return await db.get_unread_alerts(current_user.id)
-    return await db.get_user_alerts(current_user.id)
+        return rows_to_json(await db.get_unread_alerts(current_user.id), ALERT_FIELDS)
+    return rows_to_json(await db.get_user_alerts(current_user.id), ALERT_FIELDS)
 
 
 async def _get_alert_owned(alert_id: int, current_user: User):
@@ -3,10 +3,9 @@ Auth Routes
 Handles login and token issuance.
 """
 from fastapi import APIRouter, HTTPException
-import jwt
 
+from core.auth import create_access_token
 from core.database import get_db
-from core.config import get_settings
 from models.schemas import UserLogin, Token
 
 router = APIRouter(prefix="/api", tags=["auth"])
@@ -19,13 +18,12 @@ async def login(form_data: UserLogin):
     if not user:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
 
-    settings = get_settings()
     token_data = {
         "sub": str(user.id),
         "name": user.username,
         "is_admin": user.is_admin,
     }
-    token = jwt.encode(token_data, settings.secret_key, algorithm=settings.algorithm)
+    token = create_access_token(token_data)
 
     return {
         "access_token": token,
@@ -4,16 +4,20 @@ Send and inspect commands for GPS devices.
 """
 from typing import Optional
 
+import orjson
 from fastapi import APIRouter, HTTPException, Query, Depends
 
 from core.database import get_db
 from core.auth import verify_device_access
+from core.resp_cache import json_response, rows_to_json
 from models import User
-from models.schemas import CommandCreate
+from models.schemas import CommandCreate, CommandResponse
 from protocols import ProtocolRegistry
 
 router = APIRouter(prefix="/api/devices", tags=["commands"])
 
+COMMAND_FIELDS = tuple(CommandResponse.model_fields)
+
 
 @router.post("/{device_id}/command")
 async def send_command(
@@ -49,9 +53,9 @@ async def send_command(
     command.device_id = device_id
     result = await db.create_command(command)
 
-    result_dict = result.__dict__.copy() if hasattr(result, "__dict__") else dict(result)
-    result_dict["encoded_preview"] = test_bytes.hex()
-    return result_dict
+    body = {f: getattr(result, f) for f in COMMAND_FIELDS}
+    body["encoded_preview"] = test_bytes.hex()
+    return json_response(orjson.dumps(body))
 
 
 @router.post("/{device_id}/command/preview")
@@ -103,4 +107,4 @@ async def get_device_commands(
     device = await db.get_device_by_id(device_id)
     if not device:
         raise HTTPException(status_code=404, detail="Device not found")
-    return await db.get_device_commands(device_id, status=status)
+    return rows_to_json(await db.get_device_commands(device_id, status=status), COMMAND_FIELDS)
@@ -17,23 +17,43 @@ from datetime import datetime, timedelta
 from typing import List, Optional
 
 from fastapi import APIRouter, HTTPException, Query, Depends
-from sqlalchemy import select, update
+from sqlalchemy import bindparam, lambda_stmt, select, update
 
 from core.database import get_db
 from core.auth import get_current_user, require_admin, verify_device_access
+from core.resp_cache import cached_json, rows_to_json
 from models import User, Device, DeviceState
 from models.schemas import DeviceCreate, DeviceResponse, DeviceStateResponse, TripResponse
 
 router = APIRouter(prefix="/api/devices", tags=["devices"])
 
+# List endpoints encode rows directly; response_model stays for the OpenAPI schema
+DEVICE_FIELDS = tuple(DeviceResponse.model_fields)
+
+_SET_ODOMETER_STMT = lambda_stmt(
+    lambda: update(DeviceState)
+    .where(DeviceState.device_id == bindparam("device_id"))
+    .values(total_odometer=bindparam("total_odometer"))
+)
+
+
+def _query_window(start_date: Optional[datetime], end_date: Optional[datetime], default_days: int):
+    """Resolve the optional date range; defaults are truncated to the minute so polls share a cache entry."""
+    now = datetime.utcnow().replace(second=0, microsecond=0)
+    if not start_date:
+        start_date = now - timedelta(days=default_days)
+    if not end_date:
+        end_date = now
+    return start_date, end_date
+
 
 @router.get("/all", response_model=List[DeviceResponse])
 async def get_all_devices(admin: User = Depends(require_admin)):
     """Return every device in the system. Admin only."""
     db = get_db()
-    async with db.get_session() as session:
+    async with db.get_readonly_session() as session:
         result = await session.execute(select(Device))
-        return result.scalars().all()
+        return rows_to_json(result.scalars(), DEVICE_FIELDS)
 
 
 @router.get("", response_model=List[DeviceResponse])
@@ -41,10 +61,10 @@ async def get_devices(current_user: User = Depends(get_current_user)):
     """Return devices belonging to the authenticated user. Admins see all."""
     db = get_db()
     if current_user.is_admin:
-        async with db.get_session() as session:
+        async with db.get_readonly_session() as session:
             result = await session.execute(select(Device))
-            return result.scalars().all()
-    return await db.get_user_devices(current_user.id)
+            return rows_to_json(result.scalars(), DEVICE_FIELDS)
+    return rows_to_json(await db.get_user_devices(current_user.id), DEVICE_FIELDS)
 
 
 @router.post("", response_model=DeviceResponse)
@@ -95,9 +115,7 @@ async def update_device(
     if new_odometer is not None:
         async with db.get_session() as session:
             await session.execute(
-                update(DeviceState)
-                .where(DeviceState.device_id == device_id)
-                .values(total_odometer=new_odometer)
+                _SET_ODOMETER_STMT, {"device_id": device_id, "total_odometer": new_odometer}
             )
     return device
 
@@ -118,10 +136,11 @@ async def get_device_state(
     caller: User = Depends(verify_device_access),
 ):
     db = get_db()
-    device = await db.get_device_by_id(device_id)
-    if not device or not device.state:
+    # Straight to the state row; no need to load the device and its users
+    state = await db.get_device_state(device_id)
+    if not state:
         raise HTTPException(status_code=404, detail="Device state not found")
-    return device.state
+    return state
 
 
 @router.get("/{device_id}/statistics")
@@ -132,11 +151,11 @@ async def get_device_statistics(
     caller: User = Depends(verify_device_access),
 ):
     db = get_db()
-    if not start_date:
-        start_date = datetime.utcnow() - timedelta(days=30)
-    if not end_date:
-        end_date = datetime.utcnow()
-    return await db.get_device_statistics(device_id, start_date, end_date)
+    start_date, end_date = _query_window(start_date, end_date, 30)
+    return await cached_json(
+        device_id, ("statistics", start_date, end_date),
+        lambda: db.get_device_statistics(device_id, start_date, end_date),
+    )
 
 
 @router.get("/{device_id}/trips", response_model=List[TripResponse])
@@ -147,11 +166,13 @@ async def get_device_trips(
     caller: User = Depends(verify_device_access),
 ):
     db = get_db()
-    if not start_date:
-        start_date = datetime.utcnow() - timedelta(days=7)
-    if not end_date:
-        end_date = datetime.utcnow()
-    return await db.get_device_trips(device_id, start_date, end_date)
+    start_date, end_date = _query_window(start_date, end_date, 7)
+
+    async def produce():
+        trips = await db.get_device_trips(device_id, start_date, end_date)
+        return [TripResponse.model_validate(trip).model_dump() for trip in trips]
+
+    return await cached_json(device_id, ("trips", start_date, end_date), produce)
 
 
 @router.get("/{device_id}/command-support")
@@ -164,33 +185,4 @@ async def check_command_support(
     device = await db.get_device_by_id(device_id)
     if not device:
         raise HTTPException(status_code=404, detail="Device not found")
-
-    decoder = ProtocolRegistry.get_decoder(device.protocol)
-    if not decoder:
-        return {"supports_commands": False, "available_commands": [], "protocol": device.protocol, "command_info": {}}
-
-    available_commands = []
-    command_info = {}
-    if hasattr(decoder, "get_available_commands"):
-        try:
-            available_commands = decoder.get_available_commands()
-            if hasattr(decoder, "get_command_info"):
-                for cmd in available_commands:
-                    command_info[cmd] = decoder.get_command_info(cmd)
-        except Exception as e:
-            pass
-    else:
-        for cmd_type in ["reset", "interval", "reboot", "custom"]:
-            try:
-                result = await decoder.encode_command(cmd_type, {})
-                if result and len(result) > 0:
-                    available_commands.append(cmd_type)
-            except Exception:
-                pass
-
-    return {
-        "supports_commands": len(available_commands) > 0,
-        "available_commands": available_commands,
-        "protocol": device.protocol,
-        "command_info": command_info,
-    }
+    return await ProtocolRegistry.get_command_support(device.protocol)
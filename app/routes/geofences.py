@@ -25,8 +25,7 @@ async def get_geofences(
     """
     if device_id is not None and not current_user.is_admin:
         db = get_db()
-        user_devices = await db.get_user_devices(current_user.id)
-        if not any(d.id == device_id for d in user_devices):
+        if not await db.user_has_device(current_user.id, device_id):
             raise HTTPException(status_code=403, detail="You do not have access to this device")
 
     db = get_db()
@@ -41,8 +40,7 @@ async def create_geofence(
     """Create a geofence."""
     if geofence.device_id is not None and not current_user.is_admin:
         db = get_db()
-        user_devices = await db.get_user_devices(current_user.id)
-        if not any(d.id == geofence.device_id for d in user_devices):
+        if not await db.user_has_device(current_user.id, geofence.device_id):
             raise HTTPException(status_code=403, detail="You do not have access to this device")
 
     db = get_db()
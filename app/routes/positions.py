@@ -2,16 +2,25 @@
 Position Routes
 GPS position history endpoint.
 """
+from bisect import bisect_right
 from datetime import datetime
+from itertools import accumulate
+
+import orjson
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
 
 from core.database import get_db
+from core.geo import haversine_total_km
 from core.auth import get_current_user
 from models import User
-from models.schemas import PositionHistoryRequest, PositionHistoryResponse, PositionGeoJSON
+from models.schemas import PositionHistoryRequest, PositionHistoryResponse
 
 router = APIRouter(prefix="/api/positions", tags=["positions"])
 
+# Features encoded per streamed chunk
+STREAM_CHUNK_FEATURES = 500
+
 
 @router.post("/history", response_model=PositionHistoryResponse)
 async def get_position_history(
@@ -22,19 +31,12 @@ async def get_position_history(
 
     # Verify the caller has access to the requested device
     if not current_user.is_admin:
-        user_devices = await db.get_user_devices(current_user.id)
-        if not any(d.id == request.device_id for d in user_devices):
+        if not await db.user_has_device(current_user.id, request.device_id):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="You do not have access to this device",
             )
 
-    # Fetch positions and trips for the requested time range in parallel
-    positions = await db.get_position_history(
-        request.device_id, request.start_time, request.end_time,
-        request.max_points, request.order
-    )
-
     trips = await db.get_device_trips(
         request.device_id, request.start_time, request.end_time
     )
@@ -47,57 +49,80 @@ async def get_position_history(
         if start is not None:
             trip_ranges.append((start, end, t.id))
     trip_ranges.sort(key=lambda x: x[0])
+    trip_starts = [r[0] for r in trip_ranges]
+    # Latest end among trips[:i + 1]; once it is before the fix, no earlier trip can hold it
+    ends_so_far = list(accumulate((r[1] for r in trip_ranges), max))
 
     def find_trip_id(pos_time: datetime):
+        # Only trips starting at or before the fix can contain it
         t = pos_time.replace(tzinfo=None)
-        for start, end, tid in trip_ranges:
-            if start <= t <= end:
+        i = bisect_right(trip_starts, t)
+        while i and ends_so_far[i - 1] >= t:
+            i -= 1
+            start, end, tid = trip_ranges[i]
+            if t <= end:
                 return tid
         return None
 
-    features = []
-    total_distance = 0.0
-    max_speed = 0.0
-
-    for i, pos in enumerate(positions):
-        if i > 0:
-            prev = positions[i - 1]
-            async with db.get_session() as session:
-                distance_km = await db._calculate_distance(
-                    session, prev.latitude, prev.longitude, pos.latitude, pos.longitude
-                )
-                total_distance += distance_km
-
-        if pos.speed:
-            max_speed = max(max_speed, pos.speed)
-
-        features.append(PositionGeoJSON(
-            type="Feature",
-            geometry={"type": "Point", "coordinates": [pos.longitude, pos.latitude]},
-            properties={
-                "speed":     pos.speed,
-                "course":    pos.course,
-                "ignition":  pos.ignition,
-                "time":      pos.device_time.isoformat(),
-                "altitude":  pos.altitude,
-                "satellites": pos.satellites,
-                "sensors":   pos.sensors,
-                "trip_id":   find_trip_id(pos.device_time),
-            },
-        ))
-
-    duration_minutes = 0
-    if positions:
-        t1 = positions[0].device_time
-        t2 = positions[-1].device_time
-        duration_minutes = int(abs((t2 - t1).total_seconds()) / 60)
-
-    return PositionHistoryResponse(
-        type="FeatureCollection",
-        features=features,
-        summary={
+    positions = db.get_position_history(
+        request.device_id, request.start_time, request.end_time,
+        request.max_points, request.order
+    )
+
+    async def stream_features():
+        # Features go out as they come off the DB cursor; the summary follows
+        # the feature array, so it can be computed once the last row is seen.
+        latitudes = []
+        longitudes = []
+        max_speed = 0.0
+        first_time = last_time = None
+        chunk = [b'{"type":"FeatureCollection","features":[']
+        sep = b""
+
+        async for pos in positions:
+            latitudes.append(pos.latitude)
+            longitudes.append(pos.longitude)
+
+            if pos.speed:
+                max_speed = max(max_speed, pos.speed)
+
+            chunk.append(sep)
+            chunk.append(orjson.dumps({
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [pos.longitude, pos.latitude]},
+                "properties": {
+                    "speed":     pos.speed,
+                    "course":    pos.course,
+                    "ignition":  pos.ignition,
+                    "time":      pos.device_time,  # orjson writes ISO 8601
+                    "altitude":  pos.altitude,
+                    "satellites": pos.satellites,
+                    "sensors":   pos.sensors,
+                    "trip_id":   find_trip_id(pos.device_time),
+                },
+            }))
+            sep = b","
+            if len(chunk) >= STREAM_CHUNK_FEATURES * 2:
+                yield b"".join(chunk)
+                chunk.clear()
+
+            if first_time is None:
+                first_time = pos.device_time
+            last_time = pos.device_time
+
+        total_distance = haversine_total_km(latitudes, longitudes)
+
+        duration_minutes = 0
+        if first_time is not None:
+            duration_minutes = int(abs((last_time - first_time).total_seconds()) / 60)
+
+        chunk.append(b'],"summary":')
+        chunk.append(orjson.dumps({
             "total_distance_km": round(total_distance, 2),
             "duration_minutes":  duration_minutes,
             "max_speed":         round(max_speed, 1),
-        },
-    )
+        }))
+        chunk.append(b"}")
+        yield b"".join(chunk)
+
+    return StreamingResponse(stream_features(), media_type="application/geo+json")
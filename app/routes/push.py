@@ -1,10 +1,6 @@
 """
 Push Notification API Routes
-File location: app/routes/push.py   (create this new file)
-
-Then register in app/main.py:
-    from routes.push import router as push_router
-    app.include_router(push_router)
+File location: app/routes/push.py
 """
 
 from fastapi import APIRouter, Depends, HTTPException
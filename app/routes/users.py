@@ -12,25 +12,57 @@ Access rules:
 """
 from typing import List
 
+import orjson
+
 from fastapi import APIRouter, HTTPException, Query, Depends
-from sqlalchemy import select, delete
+from sqlalchemy import bindparam, select, delete, lambda_stmt
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 from core.database import get_db
 from core.auth import get_current_user, require_admin, require_self_or_admin
+from core.resp_cache import json_response
 from models import User, user_device_association
 from models.schemas import UserCreate, UserUpdate, UserResponse, DeviceResponse
 from sqlalchemy import and_
 
 router = APIRouter(prefix="/api/users", tags=["users"])
 
+USER_FIELDS = tuple(f for f in UserResponse.model_fields if f != "notification_channels")
+
+# Write statements compiled once; parameters are bound at execute time
+_DELETE_USER_STMT = lambda_stmt(
+    lambda: delete(User).where(User.id == bindparam("user_id"))
+)
+# (user_id, device_id) is the primary key, so a repeat assignment is a no-op
+_ASSIGN_DEVICE_STMT = lambda_stmt(
+    lambda: pg_insert(user_device_association)
+    .values(user_id=bindparam("user_id"), device_id=bindparam("device_id"), access_level="user")
+    .on_conflict_do_nothing(index_elements=["user_id", "device_id"])
+)
+_UNASSIGN_DEVICE_STMT = lambda_stmt(
+    lambda: user_device_association.delete().where(
+        and_(
+            user_device_association.c.user_id == bindparam("user_id"),
+            user_device_association.c.device_id == bindparam("device_id"),
+        )
+    )
+)
+
 
 @router.get("", response_model=List[UserResponse])
 async def get_all_users(admin: User = Depends(require_admin)):
     """Return all users. Admin only."""
     db = get_db()
-    async with db.get_session() as session:
+    async with db.get_readonly_session() as session:
         result = await session.execute(select(User))
-        return result.scalars().all()
+        users = []
+        for user in result.scalars():
+            row = {f: getattr(user, f) for f in USER_FIELDS}
+            # Same normalisation as UserResponse: legacy dict / NULL -> []
+            channels = user.notification_channels
+            row["notification_channels"] = channels if isinstance(channels, list) else []
+            users.append(row)
+    return json_response(orjson.dumps(users))
 
 
 @router.post("", response_model=UserResponse)
@@ -79,7 +111,7 @@ async def delete_user(user_id: int, admin: User = Depends(require_admin)):
         raise HTTPException(status_code=400, detail="You cannot delete your own account")
     db = get_db()
     async with db.get_session() as session:
-        result = await session.execute(delete(User).where(User.id == user_id))
+        result = await session.execute(_DELETE_USER_STMT, {"user_id": user_id})
         if result.rowcount == 0:
             raise HTTPException(status_code=404, detail="User not found")
     return {"status": "deleted"}
@@ -95,28 +127,10 @@ async def assign_device(
     """Assign or remove a device from a user. Admin only."""
     db = get_db()
     async with db.get_session() as session:
+        params = {"user_id": user_id, "device_id": device_id}
         if action == "add":
-            exists = await session.execute(
-                user_device_association.select().where(
-                    and_(
-                        user_device_association.c.user_id == user_id,
-                        user_device_association.c.device_id == device_id,
-                    )
-                )
-            )
-            if not exists.scalar_one_or_none():
-                await session.execute(
-                    user_device_association.insert().values(
-                        user_id=user_id, device_id=device_id, access_level="user"
-                    )
-                )
+            await session.execute(_ASSIGN_DEVICE_STMT, params)
         elif action == "remove":
-            await session.execute(
-                user_device_association.delete().where(
-                    and_(
-                        user_device_association.c.user_id == user_id,
-                        user_device_association.c.device_id == device_id,
-                    )
-                )
-            )
+            await session.execute(_UNASSIGN_DEVICE_STMT, params)
+    db.invalidate_user_devices(user_id)
     return {"status": "success"}
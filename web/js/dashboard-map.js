@@ -4,6 +4,7 @@
  */
 
 const markerState = {};
+const wsDecoder = new TextDecoder();
 
 const MAP_TILES = {
     openstreetmap: {
@@ -253,6 +254,8 @@ function connectWebSocket() {
 
     console.log('Connecting to WebSocket:', wsUrl);
     ws = new WebSocket(wsUrl);
+    // Messages arrive as binary frames of UTF-8 JSON
+    ws.binaryType = 'arraybuffer';
 
     ws.onopen = () => {
         console.log('WebSocket connected');
@@ -260,8 +263,15 @@ function connectWebSocket() {
 
     ws.onmessage = (event) => {
         try {
-            const message = JSON.parse(event.data);
-            handleWebSocketMessage(message);
+            const message = JSON.parse(
+                typeof event.data === 'string' ? event.data : wsDecoder.decode(event.data)
+            );
+            // Messages that queued up server-side arrive together as an array
+            if (Array.isArray(message)) {
+                message.forEach(handleWebSocketMessage);
+            } else {
+                handleWebSocketMessage(message);
+            }
         } catch (e) {
             console.error('Error parsing WS message:', e);
         }